@@ -1,37 +1,46 @@
 import os
 import argparse
-import glob
+import hashlib
 import json
-import time
 import logging
-from pdfminer.high_level import extract_text
-import fitz  # PyMuPDF
 import re
-from tqdm import tqdm as tdqm
-from concurrent.futures import ThreadPoolExecutor
-from openai import OpenAI
+from collections import defaultdict
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from diskCache import ResponseCache, SnippetCache, content_hash
+from extractionEngine import ExtractionEngine, write_quarantine_report
+from fileOps import UNDO_LOG_NAME, UndoLog, move_to_trash
+from fileWalker import walk_files
+from llmBackend import ChatBackend
+from rateLimiter import build_rate_limiter, estimate_tokens
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
-# Load API key from a .secret file
-def load_api_key(api_key_path):
-    with open(api_key_path, 'r') as secret_file:
-        secrets = json.load(secret_file)
-        return secrets['openai_api_key']
+PARTIAL_HASH_SIZE = 64 * 1024
+FILE_ID_PATTERN = re.compile(r'\bF[0-9a-f]{6,16}\b')
+TRAILING_COMMA_PATTERN = re.compile(r',\s*([\]}])')
 
-
-# Initialize OpenAI client
+# Chat backend (the OpenAI API unless --base_url points elsewhere), the API key is read from .secret on first use
 script_dir = os.path.dirname(os.path.realpath(__file__))
-api_key = load_api_key(os.path.join(script_dir, ".secret"))  # Replace with your API key
-client = OpenAI(api_key=api_key)
+api_key_path = os.path.join(script_dir, ".secret")
+chat_backend = ChatBackend(api_key_path=api_key_path)
 
 
-def extract_with_pymupdf(file_path, num_sentences, num_words):
+def extract_with_pymupdf(file_path, num_sentences, num_words, cache=None):
     """
     Extracts text from the first page using PyMuPDF for faster performance.
+    If a SnippetCache is given, it is consulted before opening the PDF and filled afterwards.
     """
+    params = {"engine": "fitz-first-page", "num_sentences": num_sentences, "num_words": num_words}
+    if cache:
+        cached = cache.get(file_path, params)
+        if cached is not None:
+            return cached
+
+    import fitz  # PyMuPDF
+
     snippets = []
     try:
         with fitz.open(file_path) as doc:
@@ -39,123 +48,436 @@ def extract_with_pymupdf(file_path, num_sentences, num_words):
             snippets.append(get_text_snippet(text, num_sentences, num_words))
     except Exception as e:
         logging.error(f"Failed to extract text from {file_path} using PyMuPDF: {e}")
+
+    if cache and snippets:
+        cache.put(file_path, params, snippets)
     return snippets
 
 
+WORD_PATTERN = re.compile(r'\w+')
+SENTENCE_PATTERN = re.compile(r'\S(?:.*?[.!?](?=\s)|.*\S)?', re.DOTALL)
+
+
 def get_text_snippet(text, num_sentences, num_words):
+    # Matches are pulled one at a time, so the scan stops after the last word or sentence kept
     if num_words is not None:
-        words = re.findall(r'\w+', text)  # Extract words using regex
-        return ' '.join(words[:num_words])
+        return ' '.join(match.group() for match in islice(WORD_PATTERN.finditer(text), num_words))
     else:
-        sentences = re.split(r'(?<=[.!?])\s+', text.strip())
-        return ' '.join(sentences[:num_sentences])
+        return ' '.join(match.group() for match in islice(SENTENCE_PATTERN.finditer(text), num_sentences))
+
+
+DUPLICATE_CLUSTERS_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "duplicate_clusters",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "clusters": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "file_ids": {"type": "array", "items": {"type": "string"}},
+                            "confidence": {"type": "number"},
+                        },
+                        "required": ["file_ids", "confidence"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["clusters"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+def check_duplicates_using_ai(snippet_groups, rate_limiter=None, response_cache=None, model="gpt-4o-mini",
+                              backend=None, max_attempts=3):
+    """
+    Use OpenAI (or the given ChatBackend) to check for duplicates within groups of candidate snippets.
+    This sends several groups together for a batch comparison. Each group maps short file IDs to snippets,
+    and the files are referred to by those IDs so the answer resolves to paths without ambiguity.
+    The answer follows a JSON schema and is returned as a list of (file IDs, confidence) clusters.
+    A malformed answer that cannot be repaired is requested again, up to max_attempts times in all.
+    If a rate limiter is given, the request waits for its budget and is retried on 429 responses.
+    If a response cache is given, an identical earlier request is answered from it without calling the API.
+    """
+    prompt_lines = ["Here are groups of text snippets from different PDFs. "
+                    "Within each group, find the files that appear to be duplicates based on content:", ""]
+
+    # Use file IDs in the prompt instead of filenames, which can collide across folders
+    batch_ids = set()
+    for group_number, group_snippets in enumerate(snippet_groups, 1):
+        prompt_lines.append(f"Group {group_number}:")
+        for file_id, snippet in group_snippets.items():
+            prompt_lines.append(f"File {file_id}: {snippet}")
+            batch_ids.add(file_id)
+        prompt_lines.append("")
+
+    prompt_lines.append("Answer with the clusters of duplicate files: each cluster lists the IDs of files that are "
+                        "duplicates of each other (e.g. [\"F3a9c1e\", \"F77b0d2\"]) and your confidence between 0 "
+                        "and 1. Answer with an empty list of clusters if there are no duplicates.")
+    comparison_prompt = "\n".join(prompt_lines)
+    max_tokens = min(4096, 200 + 30 * len(batch_ids))
+
+    messages = [
+        {"role": "system",
+         "content": "You are a helpful assistant that identifies duplicate text content from PDFs."},
+        {"role": "user", "content": comparison_prompt}
+    ]
+    if response_cache:
+        cache_key = response_cache.fingerprint(model, messages, max_tokens, response_format=DUPLICATE_CLUSTERS_FORMAT)
+        cached_result = response_cache.get(cache_key)
+        if cached_result is not None:
+            return parse_duplicate_clusters(cached_result, batch_ids)
+
+    backend = backend or chat_backend
+
+    def request():
+        return backend.complete(model, messages, max_tokens, response_format=DUPLICATE_CLUSTERS_FORMAT)
+
+    for attempt in range(1, max_attempts + 1):
+        response = backend.retry_engine.call(request, rate_limiter, estimate_tokens(messages, max_tokens))
+
+        result = response.choices[0].message.content or ""
+        try:
+            clusters = parse_duplicate_clusters(result, batch_ids)
+        except ValueError as e:
+            if attempt == max_attempts:
+                raise
+            logging.warning(f"Malformed duplicate answer ({e}), requesting it again")
+            continue
+        # Only well-formed answers are cached, so a malformed one is never replayed
+        if response_cache:
+            response_cache.put(cache_key, result, response.usage)
+        return clusters
+
+
+def parse_duplicate_clusters(answer, batch_ids):
+    """
+    Validates a duplicate answer against the schema and returns its clusters as (file IDs, confidence) tuples.
+    Small drifts are repaired: text around the JSON object, trailing commas, IDs written as 'File F3a9c1e',
+    unknown IDs (dropped), confidences written as strings or out of range (clamped). A missing or non-numeric
+    confidence counts as 0.0, so it never passes --min_confidence. Raises ValueError if the answer is unusable.
+    """
+    try:
+        data = json.loads(answer)
+    except ValueError:
+        start, end = answer.find("{"), answer.rfind("}")
+        if start == -1 or end < start:
+            raise ValueError("no JSON object in the answer")
+        data = json.loads(TRAILING_COMMA_PATTERN.sub(r"\1", answer[start:end + 1]))
+
+    clusters = data.get("clusters") if isinstance(data, dict) else None
+    if not isinstance(clusters, list):
+        raise ValueError("the answer has no list of clusters")
+
+    parsed = []
+    for cluster in clusters:
+        if not isinstance(cluster, dict) or not isinstance(cluster.get("file_ids"), list):
+            raise ValueError(f"invalid cluster {cluster!r}")
+        file_ids = []
+        for raw_id in cluster["file_ids"]:
+            match = FILE_ID_PATTERN.search(str(raw_id))
+            if match and match.group() in batch_ids:
+                if match.group() not in file_ids:
+                    file_ids.append(match.group())
+            else:
+                logging.warning(f"Ignoring unknown file ID {raw_id!r} in the duplicate answer")
+        if len(file_ids) > 1:
+            confidence = parse_confidence(cluster.get("confidence"), file_ids)
+            parsed.append((file_ids, confidence))
+    return parsed
+
+
+def parse_confidence(confidence, file_ids):
+    # The confidence decides whether files may be deleted, so a value that cannot be read is taken as low
+    if isinstance(confidence, (int, float, str)) and not isinstance(confidence, bool):
+        try:
+            return min(1.0, max(0.0, float(confidence)))
+        except ValueError:
+            pass
+    logging.warning(f"Unreadable confidence {confidence!r} for the cluster {', '.join(file_ids)}, counted as 0.0")
+    return 0.0
+
+
+def build_file_ids(pdf_files):
+    """
+    Gives every file a short ID derived from a hash of its path, so IDs stay the same from one run to the next.
+    Returns the ID to path index; the rare prefix collision gets a longer ID.
+    """
+    file_ids = {}
+    for file_path in sorted(pdf_files):
+        digest = hashlib.blake2b(os.path.abspath(file_path).encode(), digest_size=8).hexdigest()
+        length = 6
+        while f"F{digest[:length]}" in file_ids:
+            length += 2
+        file_ids[f"F{digest[:length]}"] = file_path
+    return file_ids
+
 
+def group_token_estimate(group, pdf_snippets):
+    return sum(len(pdf_snippets[file_path]) + 16 for file_path in group) // 4
 
-def check_duplicates_using_ai(pdf_snippets):
+
+def pack_batches(candidate_groups, pdf_snippets, batch_tokens):
+    """
+    Packs the candidate groups into batches whose prompts stay under batch_tokens estimated tokens.
+    A group too large for one batch is split into consecutive chunks of at least two files that each fit
+    where possible.
     """
-    Use OpenAI to check for duplicates among multiple snippets.
-    This sends all snippets together for a batch comparison and refers to filenames instead of snippet numbers.
+    batches = []
+    current_batch, current_tokens = [], 0
+    for group in candidate_groups:
+        chunks = [group]
+        if group_token_estimate(group, pdf_snippets) > batch_tokens:
+            chunks, chunk, chunk_tokens = [], [], 0
+            for file_path in group:
+                file_tokens = group_token_estimate([file_path], pdf_snippets)
+                if len(chunk) >= 2 and chunk_tokens + file_tokens > batch_tokens:
+                    chunks.append(chunk)
+                    chunk, chunk_tokens = [], 0
+                chunk.append(file_path)
+                chunk_tokens += file_tokens
+            if len(chunk) == 1 and chunks:
+                chunks[-1].extend(chunk)  # Never leave a file without anything to be compared with
+            else:
+                chunks.append(chunk)
+            logging.warning(f"Candidate group of {len(group)} files exceeds the batch budget, "
+                            f"split into {len(chunks)} parts that are compared separately")
+
+        for chunk in chunks:
+            tokens = group_token_estimate(chunk, pdf_snippets)
+            if current_batch and current_tokens + tokens > batch_tokens:
+                batches.append(current_batch)
+                current_batch, current_tokens = [], 0
+            current_batch.append(chunk)
+            current_tokens += tokens
+    if current_batch:
+        batches.append(current_batch)
+    return batches
+
+
+def check_batches_using_ai(batches, pdf_snippets, path_ids, rate_limiter=None, response_cache=None,
+                           max_concurrent_requests=8, model="gpt-4o-mini"):
     """
-    comparison_prompt = "Here is a list of text snippets from different PDFs. Find any pairs that appear to be duplicates based on content:\n\n"
+    Sends the batches of candidate groups concurrently and returns the duplicate clusters of each batch,
+    in the order the batches were given. A batch that still fails after its retries is skipped.
+    """
+    from tqdm import tqdm as tdqm
 
-    # Use filenames in the prompt instead of snippet numbers
-    for file, snippet in pdf_snippets.items():
-        comparison_prompt += f"File '{os.path.basename(file)}': {snippet}\n"
+    def check_batch(batch):
+        snippet_groups = [{path_ids[file_path]: pdf_snippets[file_path] for file_path in group} for group in batch]
+        return check_duplicates_using_ai(snippet_groups, rate_limiter, response_cache, model)
 
-    comparison_prompt += "\nPlease list which files are duplicates (e.g., 'File A and File B are duplicates')."
+    verdicts = [None] * len(batches)
+    with ThreadPoolExecutor(max_workers=max_concurrent_requests) as executor:
+        futures = {executor.submit(check_batch, batch): number for number, batch in enumerate(batches)}
+        for future in tdqm(as_completed(futures), total=len(futures), desc="Checking duplicates"):
+            number = futures[future]
+            try:
+                verdicts[number] = future.result()
+            except Exception as e:
+                logging.error(f"Error checking batch {number + 1} of {len(batches)} for duplicates: {e}")
+    return [verdict for verdict in verdicts if verdict is not None]
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system",
-             "content": "You are a helpful assistant that identifies duplicate text content from PDFs."},
-            {"role": "user", "content": comparison_prompt}
-        ],
-        max_tokens=1000
-    )
 
-    result = response.choices[0].message.content.strip()
-    return result
+def extract_and_store_snippet(file_path, num_sentences, num_words, cache=None):
+    """
+    Extracts text snippet from the first page of the PDF and returns it.
+    """
+    return extract_with_pymupdf(file_path, num_sentences, num_words, cache)
 
 
-def extract_and_store_snippet(file_path, num_sentences, num_words):
+def partial_hash(file_path, size):
     """
-    Extracts text snippet from the first page of the PDF and returns it.
+    Hashes the first and last PARTIAL_HASH_SIZE bytes of the file, which tells most same-size files apart.
     """
-    return extract_with_pymupdf(file_path, num_sentences, num_words)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as file:
+        digest.update(file.read(PARTIAL_HASH_SIZE))
+        if size > 2 * PARTIAL_HASH_SIZE:
+            file.seek(-PARTIAL_HASH_SIZE, os.SEEK_END)
+            digest.update(file.read(PARTIAL_HASH_SIZE))
+        elif size > PARTIAL_HASH_SIZE:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def group_by(paths, key):
+    groups = defaultdict(list)
+    for path in paths:
+        try:
+            groups[key(path)].append(path)
+        except OSError as e:
+            logging.error(f"Error reading file {path}: {e}")
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def find_exact_duplicates(pdf_files, file_stats=None):
+    """
+    Finds clusters of byte-identical files without reading most of them:
+    files are grouped by size, same-size files by a hash of their first and last blocks,
+    and only the files that still collide are hashed in full.
+    Sizes are taken from file_stats ({path: stat_result}) when given, instead of stat-ing every file again.
+    """
+    def file_size(file_path):
+        return file_stats[file_path].st_size if file_stats else os.path.getsize(file_path)
 
+    clusters = []
+    for same_size in group_by(pdf_files, file_size):
+        size = file_size(same_size[0])
+        for same_blocks in group_by(same_size, lambda path: partial_hash(path, size)):
+            if size <= 2 * PARTIAL_HASH_SIZE:
+                clusters.append(sorted(same_blocks))  # The partial hash already covered the whole file
+            else:
+                clusters.extend(sorted(same_content) for same_content in group_by(same_blocks, content_hash))
+    return sorted(clusters)
 
-def delete_file(file_path):
+
+def delete_file(file_path, trash_dir=None, undo_log=None):
     """
-    Deletes the file at the given file path.
+    Deletes the file at the given file path by moving it to the trash, where undo can bring it back from.
     """
     try:
-        os.remove(file_path)
-        logging.info(f"Deleted duplicate file: {file_path}")
+        trash_path = move_to_trash(file_path, trash_dir, undo_log)
+        logging.info(f"Deleted duplicate file: {file_path} (moved to {trash_path})")
     except OSError as e:
         logging.error(f"Error deleting file {file_path}: {e}")
 
 
-def process_pdfs_for_duplicates(file_pattern, num_sentences, num_words, sleep, delete_dupes):
+def process_pdfs_for_duplicates(file_pattern, num_sentences, num_words, rate_limiter, delete_dupes, cache=None,
+                                response_cache=None, num_perm=128, lsh_bands=32, shingle_size=3, batch_tokens=8000,
+                                max_concurrent_requests=8, keep_policy="largest", extract_workers=None,
+                                extract_timeout=None, quarantine_report=None, model="gpt-4o-mini",
+                                min_confidence=0.8, trash_dir=None, undo_log=None, include=None, exclude=None):
     """
     Processes all PDF files matching the specified file pattern and checks for duplicates.
-    This version uses parallel processing to speed up the text extraction and includes an option to delete duplicates.
+    This version extracts text in parallel worker processes and includes an option to delete duplicates.
+    Candidate duplicates are found locally with MinHash/LSH, and OpenAI only confirms the candidate groups,
+    packed into concurrent requests of at most batch_tokens prompt tokens.
+    Exact and confirmed duplicates are merged into clusters, and keep_policy picks the one file each cluster keeps.
+    Clusters the model reports with a confidence below min_confidence are only logged.
+    Deleted duplicates are moved to trash_dir (a .trash folder next to them by default) and logged in undo_log.
     """
-    pdf_snippets = {}
-    pdf_files = glob.glob(file_pattern)
+    from tqdm import tqdm as tdqm
+    from nearDuplicates import DisjointSet, MinHashLSH
 
-    with ThreadPoolExecutor() as executor:
-        futures = {
-            executor.submit(extract_and_store_snippet, file_path, num_sentences, num_words): file_path
-            for file_path in pdf_files if file_path.endswith(".pdf")
-        }
-
-        for future in tdqm(futures, desc="Processing PDFs"):
-            file_path = futures[future]
-            try:
-                snippet = future.result()
-                if snippet:
-                    pdf_snippets[file_path] = snippet[0]  # Store the first snippet of the PDF
-                else:
-                    logging.warning(f"Skipping file {file_path} due to extraction errors.")
-            except Exception as e:
-                logging.error(f"Error processing file {file_path}: {e}")
+    pdf_snippets = {}
+    # Every file is needed up front to group the exact copies; the stat results of the walk are kept for that
+    file_stats = dict(walk_files(file_pattern, include, exclude))
+    pdf_files = list(file_stats)
+
+    duplicates = DisjointSet()
+
+    # Byte-identical copies are resolved locally, only one copy of each goes on to the AI comparison
+    exact_duplicates = find_exact_duplicates(pdf_files, file_stats)
+    redundant_copies = set()
+    for cluster in exact_duplicates:
+        for copy in cluster[1:]:
+            duplicates.union(cluster[0], copy)
+        redundant_copies.update(cluster[1:])
+    if exact_duplicates:
+        logging.info(f"Found {len(redundant_copies)} exact duplicate copies in {len(exact_duplicates)} groups")
+    pdf_files = [file_path for file_path in pdf_files if file_path not in redundant_copies]
+    file_ids = build_file_ids(pdf_files)
+    path_ids = {file_path: file_id for file_id, file_path in file_ids.items()}
+
+    # Each snippet is indexed as soon as its extraction completes, so hashing overlaps with the slow PDFs
+    index = MinHashLSH(num_perm, lsh_bands, shingle_size)
+    engine = ExtractionEngine(extract_workers, timeout=extract_timeout)
+    results = engine.imap_unordered(extract_and_store_snippet, pdf_files, num_sentences=num_sentences,
+                                    num_words=num_words, cache=cache)
+    skipped = 0
+    with tdqm(total=len(pdf_files), desc="Processing PDFs", unit="file", smoothing=0.05) as progress:
+        for file_path, snippet, error in results:
+            if error:
+                logging.error(f"Error processing file {file_path}: {error}")
+                skipped += 1
+            elif snippet:
+                pdf_snippets[file_path] = snippet[0]  # Store the first snippet of the PDF
+                index.add(file_path, snippet[0])
+            else:
+                logging.warning(f"Skipping file {file_path} due to extraction errors.")
+                skipped += 1
+            progress.update()
+            if skipped:
+                progress.set_postfix(skipped=skipped, refresh=False)
+    if engine.failures and quarantine_report:
+        write_quarantine_report(engine.failures, quarantine_report)
 
-    # Send all snippets to OpenAI in one request
     if pdf_snippets:
-        duplicate_report = check_duplicates_using_ai(pdf_snippets)
-        logging.info(f"Duplicate Report:\n{duplicate_report}")
-
-        # Parse the duplicate report and delete files if requested
-        if delete_dupes:
-            # Example: Looking for 'File A and File B are duplicates' and deleting 'File B'
-            lines = duplicate_report.split('\n')
-            for line in lines:
-                if 'are duplicates' in line:
-                    # Extract filenames from the report (this logic depends on how the report is formatted)
-                    try:
-                        parts = line.split(" and ")
-                        file1 = parts[0].split("File '")[1].rstrip("'")
-                        file2 = parts[1].split("File '")[1].split(" ")[0].rstrip("'")
-
-                        file1_path = next((path for path in pdf_snippets.keys() if os.path.basename(path) == file1),
-                                          None)
-                        file2_path = next((path for path in pdf_snippets.keys() if os.path.basename(path) == file2),
-                                          None)
-
-                        if file2_path and os.path.exists(file2_path):
-                            delete_file(file2_path)  # Deleting file2 by default
-                    except Exception as e:
-                        logging.error(f"Error parsing duplicate report or deleting files: {e}")
+        # Only the groups of near-duplicate candidates found locally are sent to OpenAI for confirmation
+        candidate_groups = index.candidate_groups()
+        logging.info(f"Found {len(candidate_groups)} groups of near-duplicate candidates "
+                     f"among {len(pdf_snippets)} files")
+
+        batches = pack_batches(candidate_groups, pdf_snippets, batch_tokens)
+        verdicts = check_batches_using_ai(batches, pdf_snippets, path_ids, rate_limiter, response_cache,
+                                          max_concurrent_requests, model)
+        for clusters in verdicts:
+            for cluster_ids, confidence in clusters:
+                paths = [file_ids[file_id] for file_id in cluster_ids]
+                if confidence < min_confidence:
+                    logging.info(f"Ignoring possible duplicates below the confidence threshold "
+                                 f"({confidence:.2f}): {', '.join(paths)}")
+                    continue
+                logging.info(f"Duplicates confirmed with confidence {confidence:.2f}: {', '.join(paths)}")
+                for other in paths[1:]:
+                    duplicates.union(paths[0], other)
     else:
         logging.warning("No valid snippets to process for duplicates.")
 
+    # Pairwise verdicts are merged into clusters, and each cluster keeps exactly one file
+    for cluster in duplicates.clusters():
+        keeper = choose_keeper(cluster, keep_policy, file_stats)
+        copies = [file_path for file_path in cluster if file_path != keeper]
+        logging.info(f"Duplicates of {keeper} (kept, policy '{keep_policy}'): {', '.join(copies)}")
+        if delete_dupes:
+            for copy in copies:
+                if os.path.exists(copy):
+                    delete_file(copy, trash_dir, undo_log)
+
+
+def page_count(file_path):
+    import fitz  # PyMuPDF
+
+    try:
+        with fitz.open(file_path) as doc:
+            return len(doc)
+    except Exception as e:
+        logging.error(f"Failed to count pages of {file_path}: {e}")
+        return 0
+
+
+KEEP_POLICIES = {
+    "largest": lambda file_path, stat: -stat.st_size,
+    "newest": lambda file_path, stat: -stat.st_mtime,
+    "most_pages": lambda file_path, stat: -page_count(file_path),
+    "shortest_path": lambda file_path, stat: len(file_path),
+}
+
+
+def choose_keeper(cluster, keep_policy, file_stats=None):
+    """
+    Picks the file of a duplicate cluster to keep. Ties are broken by path so the choice is deterministic.
+    Stat results are taken from file_stats when given.
+    """
+    policy = KEEP_POLICIES[keep_policy]
+    file_stats = file_stats or {}
+    return min(cluster, key=lambda file_path: (policy(file_path, file_stats.get(file_path) or os.stat(file_path)),
+                                               file_path))
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Searches for duplicate PDFs based on their content and optionally deletes duplicates.")
     parser.add_argument("file_pattern", type=str,
-                        help="Path or file pattern for the PDF files to be processed (may include wildcards)")
+                        help="PDF file, folder (searched recursively) or file pattern of the PDFs to process; "
+                             "wildcards are allowed and '**' searches subfolders")
 
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument("--num_sentences", type=int, default=1,
@@ -163,11 +485,100 @@ if __name__ == "__main__":
     group.add_argument("--num_words", type=int,
                        help="Number of words to extract from the beginning of each page of the PDF to compare")
 
+    parser.add_argument("--include", type=str, action="append",
+                        help="Only process the files matching this glob pattern (repeatable); patterns with a '/' "
+                             "are matched against the path below the searched folder, the others against the name")
+
+    parser.add_argument("--exclude", type=str, action="append",
+                        help="Skip the files and folders matching this glob pattern (repeatable)")
+
     parser.add_argument("--delete_dupes", action="store_true",
                         help="If set, the script will delete duplicate files based on the comparison")
 
-    parser.add_argument("--sleep", type=int, default=3, help="Time to sleep between each file to avoid rate limiting")
+    parser.add_argument("--keep", type=str, default="largest", choices=sorted(KEEP_POLICIES),
+                        help="Which file of each group of duplicates is kept when deleting the others")
+
+    parser.add_argument("--sleep", type=float,
+                        help="Legacy pacing option: limit requests to one every SLEEP seconds (overrides --rpm)")
+
+    parser.add_argument("--rpm", type=float, default=500, help="Requests-per-minute budget of the OpenAI account")
+
+    parser.add_argument("--tpm", type=float, default=200000, help="Tokens-per-minute budget of the OpenAI account")
+
+    parser.add_argument("--cache_dir", type=str,
+                        help="Directory of the on-disk snippet cache; extracted snippets are reused on later runs")
+
+    parser.add_argument("--cache_size_mb", type=int, default=512,
+                        help="Maximum size of the snippet cache, least recently used entries are evicted first")
+
+    parser.add_argument("--no_llm_cache", action="store_true",
+                        help="Always call the OpenAI API instead of reusing the answers of identical earlier requests")
+
+    parser.add_argument("--llm_cache_ttl_days", type=float, default=30,
+                        help="Number of days a cached OpenAI answer stays valid")
+
+    parser.add_argument("--llm_cache_max_entries", type=int, default=100000,
+                        help="Maximum number of cached OpenAI answers, least recently used entries are evicted first")
+
+    parser.add_argument("--num_perm", type=int, default=128,
+                        help="Number of MinHash permutations used to find near-duplicate candidates")
+
+    parser.add_argument("--lsh_bands", type=int, default=32,
+                        help="Number of LSH bands; more bands find less similar candidates (must divide --num_perm)")
+
+    parser.add_argument("--shingle_size", type=int, default=3,
+                        help="Number of consecutive words per shingle when comparing snippets")
+
+    parser.add_argument("--extract_workers", type=int,
+                        help="Number of processes extracting text in parallel (default: one per CPU)")
+
+    parser.add_argument("--extract_timeout", type=float,
+                        help="Seconds after which the extraction of a file is killed and the file skipped")
+
+    parser.add_argument("--quarantine_report", type=str,
+                        help="JSON lines file listing the PDFs whose text could not be extracted")
+
+    parser.add_argument("--batch_tokens", type=int, default=8000,
+                        help="Maximum estimated prompt tokens of each duplicate confirmation request")
+
+    parser.add_argument("--max_concurrent_requests", type=int, default=8,
+                        help="Maximum number of duplicate confirmation requests in flight at once")
+
+    parser.add_argument("--model", type=str, default="gpt-4o-mini", help="OpenAI model to use")
+
+    parser.add_argument("--min_confidence", type=float, default=0.8,
+                        help="Minimum confidence (0 to 1) of the model for a group of files to count as duplicates")
+
+    parser.add_argument("--metrics_file", type=str,
+                        help="JSON file where the API call counters (retries, failures, latencies) are written at the end")
+
+    parser.add_argument("--trash_dir", type=str,
+                        help="Folder where deleted duplicates are moved (default: a .trash folder next to them)")
+
+    parser.add_argument("--base_url", type=str,
+                        help="Base URL of an OpenAI-compatible server to use instead of the OpenAI API "
+                             "(e.g. http://127.0.0.1:8000/v1 for llmStandIn.py)")
 
     args = parser.parse_args()
 
-    process_pdfs_for_duplicates(args.file_pattern, args.num_sentences, args.num_words, args.sleep, args.delete_dupes)
+    if args.base_url:
+        chat_backend = ChatBackend(base_url=args.base_url, api_key_path=api_key_path)
+    rate_limiter = build_rate_limiter(args.rpm, args.tpm, args.sleep)
+    cache = SnippetCache(args.cache_dir, args.cache_size_mb * 1024 * 1024) if args.cache_dir else None
+    response_cache = None
+    if not args.no_llm_cache:
+        response_cache = ResponseCache(args.cache_dir or os.path.join(script_dir, ".cache"),
+                                       args.llm_cache_ttl_days * 24 * 3600, args.llm_cache_max_entries)
+    undo_log = UndoLog(os.path.join(args.cache_dir or os.path.join(script_dir, ".cache"), UNDO_LOG_NAME),
+                       "aiSearchDupes")
+    try:
+        process_pdfs_for_duplicates(args.file_pattern, args.num_sentences, args.num_words, rate_limiter,
+                                    args.delete_dupes, cache, response_cache, args.num_perm, args.lsh_bands,
+                                    args.shingle_size, args.batch_tokens, args.max_concurrent_requests, args.keep,
+                                    args.extract_workers, args.extract_timeout, args.quarantine_report, args.model,
+                                    args.min_confidence, args.trash_dir, undo_log, args.include, args.exclude)
+    finally:
+        undo_log.close()
+    if response_cache:
+        response_cache.report()
+    chat_backend.retry_engine.report(args.metrics_file)
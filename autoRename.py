@@ -1,73 +1,206 @@
 import os
 import argparse
-import glob
 import json
-import time
-from openai import OpenAI
 import logging
-from nltk.tokenize import sent_tokenize
-from pdfminer.high_level import extract_text
-from pdfminer.layout import LAParams
-import fitz  # PyMuPDF
 import re
-from tqdm import tqdm as tdqm
+from collections import Counter, deque
+from functools import lru_cache
+from itertools import islice
+from diskCache import ResponseCache, RunJournal, SnippetCache, content_hash
+from extractionEngine import ExtractionEngine, write_quarantine_report
+from fileOps import CONFLICT_POLICIES, UNDO_LOG_NAME, RenameResolver, UndoLog
+from fileWalker import walk_files
+from llmBackend import ChatBackend
+from rateLimiter import build_rate_limiter, estimate_tokens
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
-# Load API key from a .secret file
-def load_api_key(api_key_path):
-    with open(api_key_path, 'r') as secret_file:
-        secrets = json.load(secret_file)
-        return secrets['openai_api_key']
+# Chat backend (the OpenAI API unless --base_url points elsewhere), the API key is read from .secret on first use
+script_dir = os.path.dirname(os.path.realpath(__file__))
+api_key_path = os.path.join(script_dir, ".secret")
+chat_backend = ChatBackend(api_key_path=api_key_path)
 
 
-# Initialize OpenAI client
-script_dir = os.path.dirname(os.path.realpath(__file__))
-api_key = load_api_key(os.path.join(script_dir, ".secret"))  # Replace with your API key
-client = OpenAI(api_key=api_key)
+def extract_with_pdfminer(file_path, num_sentences, num_words, max_pages=None, max_snippet_words=None, cache=None,
+                          sentence_splitter="nltk"):
+    """
+    Extracts a snippet from each page of the PDF, parsing one page at a time.
+    Parsing stops after max_pages pages, or as soon as the collected snippets hold
+    max_snippet_words words, so the cost follows the snippet size rather than the PDF size.
+    If a SnippetCache is given, it is consulted before parsing and filled afterwards.
+    """
+    params = {"engine": "pdfminer", "num_sentences": num_sentences, "num_words": num_words,
+              "max_pages": max_pages, "max_snippet_words": max_snippet_words, "sentence_splitter": sentence_splitter}
+    if cache:
+        cached = cache.get(file_path, params)
+        if cached is not None:
+            return cached
+
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LAParams
+
+    laparams = LAParams()
+    page_layouts = extract_pages(file_path, laparams=laparams, maxpages=max_pages or 0)
+    pages = (iter_page_text(page_layout) for page_layout in page_layouts)
+    snippets = collect_snippets(pages, num_sentences, num_words, max_snippet_words, sentence_splitter)
+
+    if cache and snippets:
+        cache.put(file_path, params, snippets)
+    return snippets
 
 
-def extract_text_snippet(file_path, num_sentences=1, num_words=None):
+def is_low_quality(snippets, min_words=5, min_printable_ratio=0.9):
+    """
+    Tells whether extracted snippets are too poor to title a file: too few words, or mostly
+    non-printable characters, replacement characters and unmapped glyphs.
+    """
+    text = ' '.join(snippets)
+    if len(text.split()) < min_words:
+        return True
+    text = text.replace(' ', '')
+    readable = sum(1 for char in text if char.isprintable() and char != '\ufffd')
+    return readable < min_printable_ratio * len(text) or text.count('(cid:') * 8 > len(text) * (1 - min_printable_ratio)
+
+
+def extract_with_engine(file_path, num_sentences, num_words, max_pages=None, max_snippet_words=None, cache=None,
+                        engine="auto", sentence_splitter="nltk"):
+    """
+    Extracts the snippets with the selected engine and returns them with the name of the engine that served them.
+    'fitz' only uses PyMuPDF, 'pdfminer' uses pdfminer.six (falling back to PyMuPDF on errors), and 'auto'
+    tries the much faster PyMuPDF first and escalates to pdfminer.six only when its text is empty or low quality.
+    """
+    options = (num_sentences, num_words, max_pages, max_snippet_words, cache, sentence_splitter)
+    if engine == "fitz":
+        return extract_with_pymupdf(file_path, *options), "fitz"
+    if engine == "pdfminer":
+        try:
+            return extract_with_pdfminer(file_path, *options), "pdfminer"
+        except Exception as e:
+            logging.warning(f"pdfminer.six failed on {file_path} with error: {e}. Falling back to PyMuPDF.")
+            return extract_with_pymupdf(file_path, *options), "fitz"
+
+    # A snippet cannot hold more words than were asked for, so the word threshold never exceeds that
+    min_words = min([5, *(limit for limit in (num_words, max_snippet_words) if limit)])
+    snippets = extract_with_pymupdf(file_path, *options)
+    if snippets and not is_low_quality(snippets, min_words):
+        return snippets, "fitz"
     try:
-        # Attempt to use pdfminer.six to extract the text
-        laparams = LAParams()
-        text = extract_text(file_path, laparams=laparams)
-        pages = text.split('\x0c')  # Split the text into pages
-        snippets = [get_text_snippet(page, num_sentences, num_words) for page in pages]
+        escalated = extract_with_pdfminer(file_path, *options)
     except Exception as e:
-        print(f"pdfminer.six failed with error: {e}. Falling back to PyMuPDF.")
-        snippets = extract_with_pymupdf(file_path, num_sentences, num_words)
+        logging.warning(f"pdfminer.six failed on {file_path} with error: {e}. Keeping the PyMuPDF text.")
+        return snippets, "fitz"
+    if escalated and (not snippets or not is_low_quality(escalated, min_words)):
+        return escalated, "pdfminer"
+    return snippets, "fitz"
+
+
+def iter_page_text(page_layout):
+    """
+    Yields the text of the page one text box at a time, so the whole page is never joined in word mode.
+    """
+    from pdfminer.layout import LTTextContainer
+    return (element.get_text() for element in page_layout if isinstance(element, LTTextContainer))
 
+
+def collect_snippets(pages, num_sentences, num_words, max_snippet_words=None, sentence_splitter="nltk"):
+    """
+    Builds one snippet per page from an iterable of page texts, each a string or an iterable of text chunks.
+    Stops pulling pages once max_snippet_words words have been collected.
+    """
+    snippets = []
+    collected_words = 0
+    for text in pages:
+        snippet = get_text_snippet(text, num_sentences, num_words, sentence_splitter)
+        snippets.append(snippet)
+        collected_words += len(snippet.split())
+        if max_snippet_words and collected_words >= max_snippet_words:
+            break
     return snippets
 
 
-def get_text_snippet(text, num_sentences, num_words):
+def get_text_snippet(text, num_sentences, num_words, sentence_splitter="nltk"):
     if num_words is not None:
-        words = re.findall(r'\w+', text)  # Extract words using regex
-        return ' '.join(words[:num_words])
+        # Words are matched one at a time and the scan stops after the last word kept
+        return ' '.join(islice(iter_words(text), num_words))
     else:
-        sentences = sent_tokenize(text)
-        return ' '.join(sentences[:num_sentences])
+        if not isinstance(text, str):
+            text = ''.join(text)
+        # Sentences are produced lazily, so the page is only scanned up to the last sentence kept
+        sentences = islice(iter_sentences(text, sentence_splitter), num_sentences)
+        return ' '.join(sentences)
+
 
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def iter_words(text):
+    """
+    Yields the words of a string, or of an iterable of text chunks, pulling chunks only as needed.
+    """
+    for chunk in (text,) if isinstance(text, str) else text:
+        for match in WORD_PATTERN.finditer(chunk):
+            yield match.group()
+
+
+SENTENCE_PATTERN = re.compile(r'\S(?:.*?[.!?](?=\s)|.*\S)?', re.DOTALL)
+
+
+def iter_sentences(text, sentence_splitter="nltk"):
+    """
+    Yields the sentences of the text one at a time, with the NLTK punkt model or,
+    with the 'regex' splitter, by cutting after '.', '!' or '?' followed by whitespace.
+    """
+    tokenizer = load_sentence_tokenizer() if sentence_splitter == "nltk" else None
+    if tokenizer is None:
+        return (match.group() for match in SENTENCE_PATTERN.finditer(text))
+    return (text[start:end] for start, end in tokenizer.span_tokenize(text))
+
+
+@lru_cache(maxsize=None)
+def load_sentence_tokenizer():
+    """
+    Loads the NLTK punkt tokenizer on first use, once per process. Returns None, so the regex
+    splitter is used instead, if the punkt model is not installed.
+    """
+    from nltk.tokenize.punkt import PunktTokenizer
+    try:
+        return PunktTokenizer()
+    except LookupError:
+        logging.warning("NLTK punkt model is not available, run nltk.download('punkt_tab') to install it. "
+                        "Falling back to the regex sentence splitter")
+        return None
+
+
+def extract_with_pymupdf(file_path, num_sentences, num_words, max_pages=None, max_snippet_words=None, cache=None,
+                         sentence_splitter="nltk"):
+    params = {"engine": "fitz", "num_sentences": num_sentences, "num_words": num_words,
+              "max_pages": max_pages, "max_snippet_words": max_snippet_words, "sentence_splitter": sentence_splitter}
+    if cache:
+        cached = cache.get(file_path, params)
+        if cached is not None:
+            return cached
+
+    import fitz  # PyMuPDF
 
-def extract_with_pymupdf(file_path, num_sentences, num_words):
     snippets = []
     try:
         with fitz.open(file_path) as doc:
-            for page in doc:
-                text = page.get_text()
-                snippets.append(get_text_snippet(text, num_sentences, num_words))
+            page_count = min(len(doc), max_pages) if max_pages else len(doc)
+            pages = (doc[page_number].get_text() for page_number in range(page_count))
+            snippets = collect_snippets(pages, num_sentences, num_words, max_snippet_words, sentence_splitter)
     except Exception as e:
         print(f"Failed to extract text using PyMuPDF: {e}")
 
+    if cache and snippets:
+        cache.put(file_path, params, snippets)
     return snippets
 
 
-def generate_creative_title(content, system_prompt, additional_prompt, max_tokens, model="gpt-4o-mini"):
+def build_title_messages(content, system_prompt, additional_prompt):
     """
-    Uses OpenAI to generate a creative title based on the extracted content.
+    Builds the chat messages used to ask for a title for the extracted content.
     """
     full_system_prompt = system_prompt
     if additional_prompt:
@@ -79,18 +212,217 @@ def generate_creative_title(content, system_prompt, additional_prompt, max_token
     logging.debug(f"System prompt: {full_system_prompt}")
     logging.debug(f"User content being sent to OpenAI: {user_content}")
 
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": full_system_prompt},
-            {"role": "user", "content": user_content}
-        ],
-        max_tokens=max_tokens  # Use configurable max_tokens value
-    )
+    return [
+        {"role": "system", "content": full_system_prompt},
+        {"role": "user", "content": user_content}
+    ]
+
+
+def generate_creative_title(content, system_prompt, additional_prompt, max_tokens, model="gpt-4o-mini",
+                            rate_limiter=None, response_cache=None, backend=None):
+    """
+    Uses OpenAI (or the given ChatBackend) to generate a creative title based on the extracted content.
+    If a rate limiter is given, the request waits for its budget and is retried on 429 responses.
+    If a response cache is given, an identical earlier request is answered from it without calling the API.
+    """
+    messages = build_title_messages(content, system_prompt, additional_prompt)
+    if response_cache:
+        cache_key = response_cache.fingerprint(model, messages, max_tokens)
+        cached_title = response_cache.get(cache_key)
+        if cached_title is not None:
+            return cached_title
+
+    backend = backend or chat_backend
+
+    def request():
+        return backend.complete(model, messages, max_tokens)  # Use configurable max_tokens value
+
+    response = backend.retry_engine.call(request, rate_limiter, estimate_tokens(messages, max_tokens))
+    title = response.choices[0].message.content.strip()
+    if response_cache:
+        response_cache.put(cache_key, title, response.usage)
+    return title
+
+
+async def generate_creative_title_async(backend, content, system_prompt, additional_prompt, max_tokens,
+                                        model="gpt-4o-mini", rate_limiter=None, response_cache=None):
+    """
+    Same as generate_creative_title, but awaits the completion on the async client of the backend.
+    """
+    messages = build_title_messages(content, system_prompt, additional_prompt)
+    if response_cache:
+        cache_key = response_cache.fingerprint(model, messages, max_tokens)
+        cached_title = response_cache.get(cache_key)
+        if cached_title is not None:
+            return cached_title
+
+    async def request():
+        return await backend.complete_async(model, messages, max_tokens)
+
+    response = await backend.retry_engine.call_async(request, rate_limiter, estimate_tokens(messages, max_tokens))
     title = response.choices[0].message.content.strip()
+    if response_cache:
+        response_cache.put(cache_key, title, response.usage)
     return title
 
 
+BATCH_RESPONSE_FORMAT = {"type": "json_object"}
+BATCH_LINGER_SECONDS = 0.5  # How long a pipeline batch waits for one more snippet before it is sent
+
+
+def build_batch_title_messages(contents, system_prompt, additional_prompt):
+    """
+    Builds the chat messages asking for the titles of several extracted contents at once,
+    each introduced by its ID (its position in the batch, from 1), with the answer as a JSON object.
+    """
+    full_system_prompt = system_prompt
+    if additional_prompt:
+        full_system_prompt += f" Additional instructions: {additional_prompt}"
+    full_system_prompt += (" You will receive several documents, each introduced by its ID. Create one title per "
+                           "document and answer with a JSON object mapping every ID to its title: "
+                           '{"titles": {"<ID>": "<title>", ...}}')
+
+    user_content = "\n\n".join(f"Document {number}:\nExtracted content:\n{content}"
+                                for number, content in enumerate(contents, 1))
+    logging.debug(f"System prompt: {full_system_prompt}")
+    logging.debug(f"User content being sent to OpenAI: {user_content}")
+
+    return [
+        {"role": "system", "content": full_system_prompt},
+        {"role": "user", "content": user_content}
+    ]
+
+
+def batch_title_tokens(content, max_tokens):
+    """
+    Estimated tokens one extracted content adds to a batched title request, its title included.
+    """
+    return len(f"Document 000:\nExtracted content:\n{content}") // 4 + max_tokens + 10
+
+
+def batch_by_tokens(items, item_tokens, batch_tokens):
+    """
+    Groups a stream of items into consecutive batches whose item_tokens(item) add up to at most batch_tokens.
+    An item over the budget on its own gets a batch to itself.
+    """
+    batch, used = [], 0
+    for item in items:
+        tokens = item_tokens(item)
+        if batch and used + tokens > batch_tokens:
+            yield batch
+            batch, used = [], 0
+        batch.append(item)
+        used += tokens
+    if batch:
+        yield batch
+
+
+def parse_batch_titles(answer, count):
+    """
+    Reads the titles of a batched answer, in ID order. IDs missing from the answer, or the whole batch
+    if the answer is not the expected JSON, come back as None.
+    """
+    try:
+        data = json.loads(answer)
+    except ValueError:
+        logging.warning("The batched title answer is not valid JSON")
+        return [None] * count
+    titles = data.get("titles", data) if isinstance(data, dict) else None
+    if not isinstance(titles, dict):
+        return [None] * count
+    parsed = []
+    for number in range(1, count + 1):
+        title = titles.get(str(number))
+        parsed.append(title.strip() if isinstance(title, str) and title.strip() else None)
+    return parsed
+
+
+def generate_creative_titles(contents, system_prompt, additional_prompt, max_tokens, model="gpt-4o-mini",
+                             rate_limiter=None, response_cache=None, backend=None):
+    """
+    Generates the titles of several extracted contents with a single request, returned in the same order.
+    Contents whose title is missing from the answer, or all of them if the request fails, are retried
+    one by one with generate_creative_title; a title that still cannot be generated is None.
+    """
+    titles = [None] * len(contents)
+    if len(contents) > 1:
+        messages = build_batch_title_messages(contents, system_prompt, additional_prompt)
+        batch_max_tokens = len(contents) * (max_tokens + 10)
+        backend = backend or chat_backend
+        try:
+            answer = None
+            if response_cache:
+                cache_key = response_cache.fingerprint(model, messages, batch_max_tokens,
+                                                       response_format=BATCH_RESPONSE_FORMAT)
+                answer = response_cache.get(cache_key)
+            if answer is None:
+                def request():
+                    return backend.complete(model, messages, batch_max_tokens, response_format=BATCH_RESPONSE_FORMAT)
+
+                response = backend.retry_engine.call(request, rate_limiter,
+                                                     estimate_tokens(messages, batch_max_tokens))
+                answer = response.choices[0].message.content
+                if response_cache:
+                    response_cache.put(cache_key, answer, response.usage)
+            titles = parse_batch_titles(answer, len(contents))
+        except Exception as e:
+            logging.error(f"Error generating a batch of {len(contents)} titles, retrying them one by one: {e}")
+
+    for number, content in enumerate(contents):
+        if titles[number] is None:
+            try:
+                titles[number] = generate_creative_title(content, system_prompt, additional_prompt, max_tokens,
+                                                         model, rate_limiter, response_cache, backend)
+            except Exception as e:
+                logging.error(f"Error generating title: {e}")
+    return titles
+
+
+async def generate_creative_titles_async(backend, contents, system_prompt, additional_prompt, max_tokens,
+                                         model="gpt-4o-mini", rate_limiter=None, response_cache=None):
+    """
+    Same as generate_creative_titles, but awaits the completions on the async client of the backend,
+    retrying the missing titles concurrently.
+    """
+    import asyncio
+
+    titles = [None] * len(contents)
+    if len(contents) > 1:
+        messages = build_batch_title_messages(contents, system_prompt, additional_prompt)
+        batch_max_tokens = len(contents) * (max_tokens + 10)
+        try:
+            answer = None
+            if response_cache:
+                cache_key = response_cache.fingerprint(model, messages, batch_max_tokens,
+                                                       response_format=BATCH_RESPONSE_FORMAT)
+                answer = response_cache.get(cache_key)
+            if answer is None:
+                async def request():
+                    return await backend.complete_async(model, messages, batch_max_tokens,
+                                                        response_format=BATCH_RESPONSE_FORMAT)
+
+                response = await backend.retry_engine.call_async(request, rate_limiter,
+                                                                 estimate_tokens(messages, batch_max_tokens))
+                answer = response.choices[0].message.content
+                if response_cache:
+                    response_cache.put(cache_key, answer, response.usage)
+            titles = parse_batch_titles(answer, len(contents))
+        except Exception as e:
+            logging.error(f"Error generating a batch of {len(contents)} titles, retrying them one by one: {e}")
+
+    missing = [number for number, title in enumerate(titles) if title is None]
+    retries = await asyncio.gather(*(generate_creative_title_async(backend, contents[number], system_prompt,
+                                                                   additional_prompt, max_tokens, model,
+                                                                   rate_limiter, response_cache)
+                                     for number in missing), return_exceptions=True)
+    for number, title in zip(missing, retries):
+        if isinstance(title, Exception):
+            logging.error(f"Error generating title: {title}")
+        else:
+            titles[number] = title
+    return titles
+
+
 def sanitize_filename(filename):
     """
     Remove or replace characters that are not allowed in Windows file names.
@@ -103,80 +435,405 @@ def sanitize_filename(filename):
     return filename.replace('  ', ' ').replace('  ', ' ').replace('  ', ' ')
 
 
-def rename_pdf(file_path, new_title, dry_mode):
+def rename_pdf(file_path, new_title, dry_mode, resolver=None):
     """
-    Renames the PDF file using the provided new title.
+    Renames the PDF file using the provided new title and returns its new path, or None if it was not renamed.
+    If the name is taken, the resolver's on_conflict policy decides what happens (a numbered suffix by default).
     If dry_mode is True, only log the renaming action without performing it.
     """
     directory, original_filename = os.path.split(file_path)
     sanitized_title = sanitize_filename(new_title)  # Sanitize the title
-    new_filename = f"{sanitized_title}.pdf"
-    new_file_path = os.path.join(directory, new_filename)
+    new_file_path = os.path.join(directory, f"{sanitized_title}.pdf")
+    resolver = resolver or RenameResolver()
 
+    try:
+        new_file_path = resolver.rename(file_path, new_file_path, dry_mode)
+    except OSError as e:
+        logging.error(f"Failed to rename file {original_filename} to {os.path.basename(new_file_path)}: {e}")
+        return None
+    if new_file_path is None:
+        return None
+
+    new_filename = os.path.basename(new_file_path)
     if dry_mode:
         logging.info(f"[DRY MODE] Would rename file {original_filename} to {new_filename}")
-    else:
-        try:
-            os.rename(file_path, new_file_path)
-            logging.info(f"File @ {original_filename} renamed to  \n ####{" " * 10} {new_filename}")
-        except FileExistsError as e:
-            logging.error(f"Failed to rename file {original_filename} to {new_filename}: {e}")
-
-            while True:
-                todo = input(
-                    "Enter 'r' to rename, 's' to skip, 'q' to quit, 'o' to open both files, d to delete current file, e to erase the existent file: ")
-                if todo == "r":
-                    new_filename = input("Enter new name: ")
-                    new_file_path = os.path.join(directory, new_filename)
-                    os.rename(file_path, new_file_path)
-                    logging.info(f"File @ {original_filename} renamed to  \n ####{" " * 10} {new_filename}")
-                    break
-                elif todo == "s":
-                    break
-                elif todo == "e":
-                    # erase the file
-                    os.remove(new_file_path)
-                    os.rename(file_path, new_file_path)
-                    break
-                elif todo == "d":
-                    # delete the  file
-                    os.remove(file_path)
-                    break
-                elif todo == "q":
-                    exit()
-                elif todo == "o":
-                    # open both file with default application
-                    os.startfile(new_file_path)
-                    os.startfile(file_path)
+        return None
+    logging.info(f"File @ {original_filename} renamed to  \n ####{' ' * 10} {new_filename}")
+    return new_file_path
+
+
+def commit_rename(file_path, new_title, dry_mode, journal=None, resolver=None):
+    """
+    Renames the PDF with rename_pdf and records the rename in the run journal.
+    """
+    new_file_path = rename_pdf(file_path, new_title, dry_mode, resolver)
+    if journal and new_file_path:
+        journal.record(file_path, "renamed", new_title, new_file_path)
+
+
+def resume_from_journal(pdf_files, journal):
+    """
+    Skips the (file_path, stat) entries the run journal records as renamed, yielding (file_path, title) for
+    the others: the journaled title of the files that were already titled, None for those still to process.
+    """
+    skipped = titled = pending = 0
+    for file_path, stat in pdf_files:
+        entry = journal.lookup(file_path, stat)
+        if entry is None or entry[0] == "extracted":
+            pending += 1
+            yield file_path, None
+        elif entry[0] == "renamed":
+            skipped += 1
+        else:
+            titled += 1
+            yield file_path, entry[1]
+    logging.info(f"Resuming: {skipped} files already renamed, {titled} renamed with their journaled titles, "
+                 f"{pending} processed")
+
+
+def find_pdf_files(file_pattern, include=None, exclude=None, journal=None, resume=False):
+    """
+    Streams (file_path, title) for the PDFs to process, skipping the work the run journal records as done when
+    resuming. The title is the journaled one of files titled by an interrupted run, and None for the others.
+    """
+    pdf_files = walk_files(file_pattern, include, exclude)
+    if journal and resume:
+        return resume_from_journal(pdf_files, journal)
+    return ((file_path, None) for file_path, _ in pdf_files)
+
+
+def file_digest(file_path, cache=None):
+    # The snippet cache remembers the digests it computed, so a cached file is not hashed twice
+    return cache.file_digest(file_path) if cache else content_hash(file_path)
+
+
+def extract_file_snippet(file_path, num_sentences, num_words, max_pages=None, max_snippet_words=None, cache=None,
+                         engine="auto", sentence_splitter="nltk", with_digest=False):
+    """
+    Extracts the title snippet of a single PDF with the command line extraction options.
+    Returns the snippets, the name of the engine that produced them and, with with_digest,
+    the content hash of the file (None otherwise), computed where the extraction runs.
+    """
+    if num_words:
+        num_sentences = None
+    snippets, engine_used = extract_with_engine(file_path, num_sentences, num_words, max_pages, max_snippet_words,
+                                                cache, engine, sentence_splitter)
+    return snippets, engine_used, file_digest(file_path, cache) if with_digest else None
+
+
+def extract_file_snippet_with_pymupdf(file_path, num_sentences, num_words, max_pages=None, max_snippet_words=None,
+                                      cache=None, engine=None, sentence_splitter="nltk", with_digest=False):
+    """
+    Cheaper fallback of extract_file_snippet for files the selected engine could not handle in time.
+    """
+    snippets = extract_with_pymupdf(file_path, None if num_words else num_sentences, num_words, max_pages,
+                                    max_snippet_words, cache, sentence_splitter)
+    if not snippets:
+        raise ValueError("PyMuPDF could not extract any text either")
+    return snippets, "fitz", file_digest(file_path, cache) if with_digest else None
+
+
+def warm_up_extraction():
+    """
+    Runs once in each extraction worker process so the NLTK punkt model is loaded before the first file.
+    """
+    load_sentence_tokenizer()
 
 
-def process_pdfs(file_pattern, num_sentences, num_words, system_prompt, additional_prompt, max_tokens, dry_mode, sleep,
-                 model):
+def extract_snippets(pdf_files, num_sentences, num_words, max_pages=None, max_snippet_words=None, cache=None,
+                     extract_workers=None, extract_timeout=None, quarantine_report=None, engine="auto",
+                     sentence_splitter="nltk", with_digest=False, start_method=None):
     """
-    Processes all PDF files matching the specified file pattern.
+    Yields (file_path, snippet, engine_used, digest) for every PDF, the digest being the content hash of the file
+    with with_digest and None otherwise. With extract_workers, extraction runs in that many worker processes and
+    the files come back in the order they complete; otherwise one by one in-process.
+    With extract_timeout, a file whose extraction takes longer is abandoned and retried with PyMuPDF;
+    files that still fail are written to the quarantine report. start_method is how worker processes are started.
     """
-    for file_path in tdqm(glob.glob(file_pattern), "PDFs processing"):
-        if file_path.endswith(".pdf"):
-            logging.info(f"Processing file: {file_path}")
-            if num_words:
-                snippet = extract_text_snippet(file_path, num_sentences=None, num_words=num_words)
+    engines_used = Counter()
+    if not extract_workers and not extract_timeout:
+        for file_path in pdf_files:
+            snippet, engine_used, digest = extract_file_snippet(file_path, num_sentences, num_words, max_pages,
+                                                                max_snippet_words, cache, engine, sentence_splitter,
+                                                                with_digest)
+            engines_used[engine_used] += 1
+            yield file_path, snippet, engine_used, digest
+    else:
+        warm_up = warm_up_extraction if not num_words and sentence_splitter == "nltk" else None
+        extractor = ExtractionEngine(extract_workers or 1, initializer=warm_up, timeout=extract_timeout,
+                                     fallback=extract_file_snippet_with_pymupdf, start_method=start_method)
+        results = extractor.imap_unordered(extract_file_snippet, pdf_files, num_sentences=num_sentences,
+                                           num_words=num_words, max_pages=max_pages,
+                                           max_snippet_words=max_snippet_words, cache=cache, engine=engine,
+                                           sentence_splitter=sentence_splitter, with_digest=with_digest)
+        for file_path, result, error in results:
+            if error:
+                logging.error(f"Error extracting text from {file_path}: {error}")
+                yield file_path, None, None, None
+                continue
+            snippet, engine_used, digest = result
+            engines_used[engine_used] += 1
+            yield file_path, snippet, engine_used, digest
+
+        if extractor.failures:
+            if quarantine_report:
+                write_quarantine_report(extractor.failures, quarantine_report)
             else:
-                snippet = extract_text_snippet(file_path, num_sentences=num_sentences)
+                logging.warning(f"Could not extract {len(extractor.failures)} files: "
+                                f"{', '.join(file_path for file_path, _ in extractor.failures)}")
 
-            if snippet:
-                creative_title = generate_creative_title(snippet, system_prompt, additional_prompt, max_tokens, model)
-                rename_pdf(file_path, creative_title, dry_mode)
+    logging.info(f"Extraction engines used: "
+                 f"{', '.join(f'{name}: {count}' for name, count in engines_used.most_common()) or 'none'}")
+
+
+def process_pdfs(file_pattern, num_sentences, num_words, system_prompt, additional_prompt, max_tokens, dry_mode,
+                 rate_limiter, model, max_pages=None, max_snippet_words=None, cache=None, response_cache=None,
+                 extract_workers=None, extract_timeout=None, quarantine_report=None, engine="auto",
+                 sentence_splitter="nltk", batch_tokens=None, journal=None, resume=False, resolver=None, include=None,
+                 exclude=None):
+    """
+    Processes all PDF files matching the specified file pattern, as they are found.
+    With batch_tokens, the titles of consecutive files are requested together, batched up to that token estimate.
+    With a journal, the progress of every file is recorded, and with resume the work it records as done is skipped.
+    """
+    from tqdm import tqdm as tdqm
+
+    pdf_files = find_pdf_files(file_pattern, include, exclude, journal, resume)
+    journaled = deque()  # Files titled by an interrupted run, renamed by the loop below rather than by the walker
 
+    def untitled_files():
+        for file_path, title in pdf_files:
+            if title:
+                journaled.append((file_path, title))
+            else:
+                yield file_path
+
+    def rename_journaled():
+        while journaled:
+            commit_rename(*journaled.popleft(), dry_mode, journal, resolver)
+            progress.update()
+
+    snippets = extract_snippets(untitled_files(), num_sentences, num_words, max_pages, max_snippet_words, cache,
+                                extract_workers, extract_timeout, quarantine_report, engine, sentence_splitter,
+                                bool(journal))
+    if batch_tokens:
+        batches = batch_by_tokens(snippets, lambda item: batch_title_tokens(item[1], max_tokens) if item[1] else 0,
+                                  batch_tokens)
+    else:
+        batches = ([item] for item in snippets)
+
+    with tdqm(desc="PDFs processing", unit="file") as progress:
+        for batch in batches:
+            rename_journaled()
+            titled = []
+            for file_path, snippet, engine_used, digest in batch:
+                logging.info(f"Processing file: {file_path} (text extracted with {engine_used})")
+                if snippet:
+                    titled.append((file_path, snippet))
+                    if journal:
+                        journal.record(file_path, "extracted", digest=digest)
+                else:
+                    logging.warning(f"Skipping file {file_path} due to extraction errors.")
+
+            if titled:
+                contents = [snippet for _, snippet in titled]
+                if batch_tokens:
+                    creative_titles = generate_creative_titles(contents, system_prompt, additional_prompt, max_tokens,
+                                                               model, rate_limiter, response_cache)
+                else:
+                    try:
+                        creative_titles = [generate_creative_title(contents[0], system_prompt, additional_prompt,
+                                                                   max_tokens, model, rate_limiter, response_cache)]
+                    except Exception as e:
+                        # Retries are exhausted, the file is skipped rather than ending the whole run
+                        logging.error(f"Error generating title for {titled[0][0]}: {e}")
+                        creative_titles = [None]
+                for (file_path, _), creative_title in zip(titled, creative_titles):
+                    if creative_title:
+                        if journal:
+                            journal.record(file_path, "titled", creative_title)
+                        commit_rename(file_path, creative_title, dry_mode, journal, resolver)
+            progress.update(len(batch))
+        rename_journaled()
+
+    if response_cache:
+        response_cache.report()
+
+
+def process_pdfs_pipelined(file_pattern, num_sentences, num_words, system_prompt, additional_prompt, max_tokens,
+                           dry_mode, model, workers, max_concurrent_requests, rate_limiter=None, max_pages=None,
+                           max_snippet_words=None, cache=None, response_cache=None, extract_timeout=None,
+                           quarantine_report=None, engine="auto", sentence_splitter="nltk", batch_tokens=None,
+                           journal=None, resume=False, resolver=None, include=None, exclude=None):
+    """
+    Processes all PDF files matching the specified file pattern as a pipeline:
+    extraction runs in a pool of `workers` processes feeding a bounded queue, up to
+    `max_concurrent_requests` title completions are in flight at once, and a single
+    committer applies the renames in the order the files are found.
+    With batch_tokens, snippets are gathered into completions of up to that token estimate, each sent once
+    it is full, the input is exhausted or no new snippet came for BATCH_LINGER_SECONDS.
+    With a journal, the progress of every file is recorded, and with resume the work it records as done is skipped.
+    """
+    import asyncio
+
+    pdf_files = find_pdf_files(file_pattern, include, exclude, journal, resume)
+    asyncio.run(_run_pipeline(pdf_files, num_sentences, num_words, system_prompt, additional_prompt, max_tokens,
+                              dry_mode, model, workers, max_concurrent_requests, rate_limiter, max_pages,
+                              max_snippet_words, cache, response_cache, extract_timeout, quarantine_report,
+                              engine, sentence_splitter, batch_tokens, journal, resolver))
+    if response_cache:
+        response_cache.report()
+
+
+async def _run_pipeline(pdf_files, num_sentences, num_words, system_prompt, additional_prompt, max_tokens, dry_mode,
+                        model, workers, max_concurrent_requests, rate_limiter, max_pages, max_snippet_words, cache,
+                        response_cache, extract_timeout, quarantine_report, engine, sentence_splitter, batch_tokens,
+                        journal, resolver):
+    import asyncio
+    import multiprocessing
+    from tqdm import tqdm as tdqm
+
+    # The extraction workers are started from a helper thread while the event loop runs, and a process forked
+    # from a threaded parent can inherit locks held by the other threads, so they are never forked from here
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    loop = asyncio.get_running_loop()
+    file_indexes = {}  # Files handed to the extraction and not returned yet, by position in the input
+    total = []  # Number of files, known once the input is exhausted
+    snippet_queue = asyncio.Queue(maxsize=workers * 2)
+    title_queue = asyncio.Queue()
+
+    journaled = []  # Positions of the files titled by an interrupted run, handed straight to the committer
+
+    def numbered_files():
+        # Files are numbered as the extraction pulls them from the walker, which only runs ahead by a few chunks
+        for index, (file_path, title) in enumerate(pdf_files):
+            if title:
+                journaled.append(index)
+                asyncio.run_coroutine_threadsafe(title_queue.put((index, file_path, title)), loop).result()
+                continue
+            file_indexes[file_path] = index
+            yield file_path
+
+    def extract_all():
+        # Runs in a helper thread; blocking on the queue puts gives the extraction workers backpressure
+        count = 0
+        try:
+            snippets = extract_snippets(numbered_files(), num_sentences, num_words, max_pages, max_snippet_words,
+                                        cache, workers, extract_timeout, quarantine_report, engine, sentence_splitter,
+                                        bool(journal), start_method)
+            for file_path, snippet, engine_used, digest in snippets:
+                logging.info(f"Processing file: {file_path} (text extracted with {engine_used})")
+                if journal and snippet:
+                    journal.record(file_path, "extracted", digest=digest)
+                item = (file_indexes.pop(file_path), file_path, snippet)
+                asyncio.run_coroutine_threadsafe(snippet_queue.put(item), loop).result()
+                count += 1
+        except Exception as e:
+            logging.error(f"Extraction stopped early: {e}")
+        # Files the extraction never returned are skipped, so the committer is not left waiting for them
+        for file_path, index in list(file_indexes.items()):
+            asyncio.run_coroutine_threadsafe(snippet_queue.put((index, file_path, None)), loop).result()
+        return count + len(journaled) + len(file_indexes)
+
+    def title_tokens(item):
+        return batch_title_tokens(item[2], max_tokens) if item[2] else 0
+
+    async def titler():
+        while (item := await snippet_queue.get()) is not None:
+            await title_batch([item])
+
+    async def batcher():
+        # A single coroutine packs the batches, so that idle requests do not each take one snippet as it arrives;
+        # up to max_concurrent_requests batches are in flight at once
+        slots = asyncio.Semaphore(max_concurrent_requests)
+        in_flight = set()
+        held = None  # Item taken from the queue that did not fit in the previous batch
+        exhausted = False
+        while not exhausted and (item := held or await snippet_queue.get()) is not None:
+            held = None
+            batch, used = [item], title_tokens(item)
+            while used < batch_tokens:
+                try:
+                    item = await asyncio.wait_for(snippet_queue.get(), BATCH_LINGER_SECONDS)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    exhausted = True
+                    break
+                if used + title_tokens(item) > batch_tokens:
+                    held = item
+                    break
+                batch.append(item)
+                used += title_tokens(item)
+            await slots.acquire()
+            task = asyncio.create_task(title_batch(batch))
+            in_flight.add(task)
+            task.add_done_callback(lambda done: (in_flight.discard(done), slots.release()))
+        await asyncio.gather(*in_flight)
+
+    async def title_batch(batch):
+        titled = []
+        for index, file_path, snippet in batch:
+            if snippet:
+                titled.append((index, file_path, snippet))
             else:
                 logging.warning(f"Skipping file {file_path} due to extraction errors.")
-
-            time.sleep(sleep)  # Sleep for 3 second to avoid rate limiting
+                await title_queue.put((index, file_path, None))
+        if not titled:
+            return
+        if batch_tokens:
+            titles = await generate_creative_titles_async(chat_backend, [snippet for _, _, snippet in titled],
+                                                          system_prompt, additional_prompt, max_tokens, model,
+                                                          rate_limiter, response_cache)
+        else:
+            index, file_path, snippet = titled[0]
+            try:
+                titles = [await generate_creative_title_async(chat_backend, snippet, system_prompt, additional_prompt,
+                                                              max_tokens, model, rate_limiter, response_cache)]
+            except Exception as e:
+                logging.error(f"Error generating title for {file_path}: {e}")
+                titles = [None]
+        for (index, file_path, _), title in zip(titled, titles):
+            await title_queue.put((index, file_path, title))
+
+    async def committer():
+        # Renames are applied in input order, whatever order the titles come back in
+        ready = {}
+        next_index = 0
+        with tdqm(desc="PDFs processing", unit="file") as progress:
+            while not total or next_index < total[0]:
+                item = await title_queue.get()
+                if item is None:
+                    continue  # The input is exhausted, the loop condition now knows the total
+                index, file_path, title = item
+                ready[index] = (file_path, title)
+                while next_index in ready:
+                    file_path, title = ready.pop(next_index)
+                    if title:
+                        if journal:
+                            journal.record(file_path, "titled", title)
+                        commit_rename(file_path, title, dry_mode, journal, resolver)
+                    next_index += 1
+                    progress.update()
+
+    async def feed():
+        total.append(await loop.run_in_executor(None, extract_all))
+        await title_queue.put(None)
+        for _ in range(1 if batch_tokens else max_concurrent_requests):
+            await snippet_queue.put(None)
+
+    titlers = [batcher()] if batch_tokens else [titler() for _ in range(max_concurrent_requests)]
+    try:
+        await asyncio.gather(feed(), committer(), *titlers)
+    finally:
+        await chat_backend.aclose()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Renames PDF files based on their content.")
     parser.add_argument("file_pattern", type=str,
-                        help="Path or file pattern for the PDF files to be processed (may include wildcards)")
+                        help="PDF file, folder (searched recursively) or file pattern of the PDFs to process; "
+                             "wildcards are allowed and '**' searches subfolders")
 
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument("--num_sentences", type=int, default=1,
@@ -184,6 +841,13 @@ if __name__ == "__main__":
     group.add_argument("--num_words", type=int,
                        help="Number of words to extract from the beginning of each page of the PDF to generate a title")
 
+    parser.add_argument("--include", type=str, action="append",
+                        help="Only process the files matching this glob pattern (repeatable); patterns with a '/' "
+                             "are matched against the path below the searched folder, the others against the name")
+
+    parser.add_argument("--exclude", type=str, action="append",
+                        help="Skip the files and folders matching this glob pattern (repeatable)")
+
     parser.add_argument("--system_prompt", type=str,
                         default="You are a helpful assistant. Use the information below to create a creative title.",
                         help="The base system prompt to set the context for the OpenAI model")
@@ -197,10 +861,113 @@ if __name__ == "__main__":
     parser.add_argument("--dry_mode", action="store_true",
                         help="If set, the script will not actually rename files but will log what it would do")
 
-    parser.add_argument("--sleep", type=int, default=3, help="Time to sleep between each file to avoid rate limiting")
+    parser.add_argument("--sleep", type=float,
+                        help="Legacy pacing option: limit title requests to one every SLEEP seconds (overrides --rpm)")
+
+    parser.add_argument("--rpm", type=float, default=500, help="Requests-per-minute budget of the OpenAI account")
+
+    parser.add_argument("--tpm", type=float, default=200000, help="Tokens-per-minute budget of the OpenAI account")
 
     parser.add_argument("--model", type=str, default="gpt-4o-mini", help="OpenAI model to use")
-    args = parser.parse_args()
 
-    process_pdfs(args.file_pattern, args.num_sentences, args.num_words, args.system_prompt, args.additional_prompt,
-                 args.max_tokens, args.dry_mode, args.sleep, args.model)
+    parser.add_argument("--metrics_file", type=str,
+                        help="JSON file where the API call counters (retries, failures, latencies) are written at the end")
+
+    parser.add_argument("--base_url", type=str,
+                        help="Base URL of an OpenAI-compatible server to use instead of the OpenAI API "
+                             "(e.g. http://127.0.0.1:8000/v1 for llmStandIn.py)")
+
+    parser.add_argument("--max_pages", type=int, default=10,
+                        help="Maximum number of pages to read from each PDF (0 reads every page)")
+
+    parser.add_argument("--max_snippet_words", type=int, default=200,
+                        help="Stop reading pages once the collected snippets hold this many words (0 disables the limit)")
+
+    parser.add_argument("--sentence_splitter", choices=["nltk", "regex"], default="nltk",
+                        help="How --num_sentences splits sentences: the NLTK punkt model, or a faster regex on .!? marks")
+
+    parser.add_argument("--engine", choices=["auto", "fitz", "pdfminer"], default="auto",
+                        help="Text extraction engine; 'auto' uses PyMuPDF and escalates to pdfminer.six on poor text")
+
+    parser.add_argument("--workers", type=int,
+                        help="If set, process files as a pipeline with this many extraction processes instead of one by one")
+
+    parser.add_argument("--extract_workers", type=int,
+                        help="Number of processes extracting text in parallel (overrides the --workers count)")
+
+    parser.add_argument("--extract_timeout", type=float,
+                        help="Seconds after which the extraction of a file is killed and retried with PyMuPDF")
+
+    parser.add_argument("--quarantine_report", type=str,
+                        help="JSON lines file listing the PDFs whose text could not be extracted")
+
+    parser.add_argument("--max_concurrent_requests", type=int, default=8,
+                        help="Maximum number of title requests in flight at once when --workers is set")
+
+    parser.add_argument("--batch_tokens", type=int,
+                        help="If set, request the titles of several files at once, packing snippets into requests "
+                             "of at most this many estimated tokens")
+
+    parser.add_argument("--cache_dir", type=str,
+                        help="Directory of the on-disk snippet cache; extracted snippets are reused on later runs")
+
+    parser.add_argument("--cache_size_mb", type=int, default=512,
+                        help="Maximum size of the snippet cache, least recently used entries are evicted first")
+
+    parser.add_argument("--no_llm_cache", action="store_true",
+                        help="Always call the OpenAI API instead of reusing the answers of identical earlier requests")
+
+    parser.add_argument("--llm_cache_ttl_days", type=float, default=30,
+                        help="Number of days a cached OpenAI answer stays valid")
+
+    parser.add_argument("--llm_cache_max_entries", type=int, default=100000,
+                        help="Maximum number of cached OpenAI answers, least recently used entries are evicted first")
+
+    parser.add_argument("--on_conflict", choices=CONFLICT_POLICIES, default="suffix",
+                        help="What to do when the new name is taken: add a numbered suffix, skip the file, add a short "
+                             "content hash, overwrite the existing file, or ask")
+
+    parser.add_argument("--trash_dir", type=str,
+                        help="Folder where files replaced by --on_conflict overwrite are moved (default: a .trash "
+                             "folder next to them)")
+
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip the files the run journal records as renamed, and rename the already titled ones "
+                             "without a new request")
+
+    parser.add_argument("--no_journal", action="store_true",
+                        help="Do not record the progress of each file in the run journal")
+    args = parser.parse_args()
+    if args.resume and args.no_journal:
+        parser.error("--resume needs the run journal, it cannot be combined with --no_journal")
+
+    if args.base_url:
+        chat_backend = ChatBackend(base_url=args.base_url, api_key_path=api_key_path)
+    rate_limiter = build_rate_limiter(args.rpm, args.tpm, args.sleep)
+    cache = SnippetCache(args.cache_dir, args.cache_size_mb * 1024 * 1024) if args.cache_dir else None
+    response_cache = None
+    if not args.no_llm_cache:
+        response_cache = ResponseCache(args.cache_dir or os.path.join(script_dir, ".cache"),
+                                       args.llm_cache_ttl_days * 24 * 3600, args.llm_cache_max_entries)
+    state_dir = args.cache_dir or os.path.join(script_dir, ".cache")
+    undo_log = UndoLog(os.path.join(state_dir, UNDO_LOG_NAME), "autoRename")
+    resolver = RenameResolver(args.on_conflict, undo_log, args.trash_dir)
+    journal = None if args.no_journal else RunJournal(state_dir)
+    try:
+        if args.workers:
+            process_pdfs_pipelined(args.file_pattern, args.num_sentences, args.num_words, args.system_prompt,
+                                   args.additional_prompt, args.max_tokens, args.dry_mode, args.model,
+                                   args.extract_workers or args.workers,
+                                   args.max_concurrent_requests, rate_limiter, args.max_pages, args.max_snippet_words,
+                                   cache, response_cache, args.extract_timeout, args.quarantine_report, args.engine,
+                                   args.sentence_splitter, args.batch_tokens, journal, args.resume, resolver,
+                                   args.include, args.exclude)
+        else:
+            process_pdfs(args.file_pattern, args.num_sentences, args.num_words, args.system_prompt,
+                         args.additional_prompt, args.max_tokens, args.dry_mode, rate_limiter, args.model,
+                         args.max_pages, args.max_snippet_words, cache, response_cache, args.extract_workers,
+                         args.extract_timeout, args.quarantine_report, args.engine, args.sentence_splitter,
+                         args.batch_tokens, journal, args.resume, resolver, args.include, args.exclude)
+    finally:
+        undo_log.close()
+    chat_backend.retry_engine.report(args.metrics_file)
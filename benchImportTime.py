@@ -0,0 +1,71 @@
+import argparse
+import logging
+import os
+import statistics
+import subprocess
+import sys
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Dependencies that must only be imported when a file is actually extracted or a request is sent
+HEAVY_MODULES = ["openai", "fitz", "pymupdf", "pdfminer", "nltk", "numpy", "tqdm", "httpx"]
+
+
+def measure_import(module, python=sys.executable):
+    """
+    Imports the module in a fresh interpreter with -X importtime and returns
+    ({imported module: cumulative microseconds}, cumulative microseconds of the module itself).
+    """
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    result = subprocess.run([python, "-X", "importtime", "-c", f"import {module}"], cwd=script_dir,
+                            capture_output=True, text=True, check=True)
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        timings[name.strip()] = int(cumulative)
+    return timings, timings[module]
+
+
+def check_module(module, runs, budget_ms, top):
+    """
+    Logs the median cold import time of the module and returns False if it exceeds the budget
+    or if any heavy dependency was imported eagerly.
+    """
+    samples = []
+    for _ in range(runs):
+        timings, total = measure_import(module)
+        samples.append(total / 1000)
+    median = statistics.median(samples)
+
+    eager = sorted(name for name in timings if name.split(".")[0] in HEAVY_MODULES)
+    slowest = sorted(timings.items(), key=lambda item: item[1], reverse=True)[1:top + 1]
+    logging.info(f"{module}: median cold import {median:.1f} ms over {runs} runs (budget {budget_ms} ms)")
+    for name, cumulative in slowest:
+        logging.info(f"    {cumulative / 1000:8.1f} ms  {name}")
+
+    ok = True
+    if median > budget_ms:
+        logging.error(f"{module} takes {median:.1f} ms to import, over the {budget_ms} ms budget")
+        ok = False
+    if eager:
+        logging.error(f"{module} imports heavy dependencies at start-up: {', '.join(eager)}")
+        ok = False
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Checks that the scripts import quickly, without loading their heavy dependencies.")
+    parser.add_argument("modules", nargs="*", default=["autoRename", "aiSearchDupes"],
+                        help="Modules to import (default: autoRename aiSearchDupes)")
+    parser.add_argument("--runs", type=int, default=5, help="Number of cold imports per module, the median is kept")
+    parser.add_argument("--budget_ms", type=float, default=150,
+                        help="Maximum median import time in milliseconds (as measured under -X importtime)")
+    parser.add_argument("--top", type=int, default=5, help="Number of slowest imports to list per module")
+    args = parser.parse_args()
+
+    results = [check_module(module, args.runs, args.budget_ms, args.top) for module in args.modules]
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,323 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def content_hash(file_path):
+    """
+    Streams the file through BLAKE2b and returns its hex digest.
+    """
+    digest = hashlib.blake2b(digest_size=32)
+    with open(file_path, 'rb') as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+_process_stores = {}  # Stores unpickled in this process, by (class, path, pid)
+
+
+def _unpickle_store(cls, state):
+    # Worker processes receive the store with every task; they all get the same instance, and so one connection
+    key = (cls, state["path"], os.getpid())
+    store = _process_stores.get(key)
+    if store is None:
+        store = cls.__new__(cls)
+        store.__dict__.update(state)
+        store._lock = threading.Lock()
+        _process_stores[key] = store
+    return store
+
+
+class _SqliteStore:
+    """
+    Lazily opened SQLite connection shared by the caches. Only the settings survive pickling, so a store
+    can be handed to worker threads and processes; each process unpickles a single instance per path,
+    which opens its own connection once.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def __reduce__(self):
+        state = self.__dict__.copy()
+        state.update(_connection=None, _pid=None, _lock=None)
+        return _unpickle_store, (type(self), state)
+
+    def _db(self):
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._create_tables(self._connection)
+            self._pid = os.getpid()
+        return self._connection
+
+    def _create_tables(self, db):
+        raise NotImplementedError
+
+
+class SnippetCache(_SqliteStore):
+    """
+    SQLite cache of extracted snippets, keyed by the content hash of the PDF and the extraction parameters.
+
+    File digests are remembered per (path, size, mtime) so unchanged files are not re-hashed on every run.
+    Entries are evicted least-recently-used first once the stored snippets exceed max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024):
+        os.makedirs(cache_dir, exist_ok=True)
+        super().__init__(os.path.join(cache_dir, "snippets.sqlite3"))
+        self.max_bytes = max_bytes
+        self._total_bytes = None
+
+    def _create_tables(self, db):
+        db.execute("CREATE TABLE IF NOT EXISTS snippets "
+                   "(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)")
+        db.execute("CREATE INDEX IF NOT EXISTS snippets_last_access ON snippets (last_access)")
+        db.execute("CREATE TABLE IF NOT EXISTS digests "
+                   "(path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, digest TEXT NOT NULL)")
+        self._total_bytes = None
+
+    def file_digest(self, file_path):
+        """
+        Returns the content hash of the file, re-hashing it only when its size or mtime changed.
+        """
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        with self._lock:
+            row = self._db().execute("SELECT size, mtime_ns, digest FROM digests WHERE path = ?", (path,)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+
+        digest = content_hash(path)
+        with self._lock:
+            self._db().execute("INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?)",
+                               (path, stat.st_size, stat.st_mtime_ns, digest))
+        return digest
+
+    def _key(self, file_path, params):
+        fingerprint = json.dumps(params, sort_keys=True)
+        return hashlib.sha256(f"{self.file_digest(file_path)}:{fingerprint}".encode()).hexdigest()
+
+    def get(self, file_path, params):
+        """
+        Returns the cached snippets of the file for these extraction parameters, or None.
+        """
+        try:
+            key = self._key(file_path, params)
+            with self._lock:
+                db = self._db()
+                row = db.execute("SELECT value FROM snippets WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                db.execute("UPDATE snippets SET last_access = ? WHERE key = ?", (time.time(), key))
+            return json.loads(row[0])
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"Snippet cache lookup failed for {file_path}: {e}")
+            return None
+
+    def put(self, file_path, params, snippets):
+        try:
+            key = self._key(file_path, params)
+            value = json.dumps(snippets)
+            with self._lock:
+                db = self._db()
+                if self._total_bytes is None:
+                    self._total_bytes = db.execute("SELECT COALESCE(SUM(size), 0) FROM snippets").fetchone()[0]
+                db.execute("INSERT OR REPLACE INTO snippets VALUES (?, ?, ?, ?)",
+                           (key, value, len(value), time.time()))
+                self._total_bytes += len(value)
+                if self._total_bytes > self.max_bytes:
+                    self._evict(db)
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"Snippet cache store failed for {file_path}: {e}")
+
+    def _evict(self, db):
+        # Trim to 90% of the budget so evictions do not run on every insert
+        target = self.max_bytes * 0.9
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM snippets").fetchone()[0]
+        while total > target:
+            oldest = db.execute("SELECT key, size FROM snippets ORDER BY last_access LIMIT 256").fetchall()
+            if not oldest:
+                break
+            for key, size in oldest:
+                if total <= target:
+                    break
+                db.execute("DELETE FROM snippets WHERE key = ?", (key,))
+                total -= size
+        self._total_bytes = total
+
+
+class ResponseCache(_SqliteStore):
+    """
+    SQLite memoization of chat completions, keyed by a hash of the full request payload.
+
+    Each entry records the token usage of the original call, so hits can be reported as saved tokens.
+    Entries expire after ttl_seconds and the least recently used ones are evicted beyond max_entries.
+    """
+
+    def __init__(self, cache_dir, ttl_seconds=30 * 24 * 3600, max_entries=100000):
+        os.makedirs(cache_dir, exist_ok=True)
+        super().__init__(os.path.join(cache_dir, "responses.sqlite3"))
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.saved_prompt_tokens = 0
+        self.saved_completion_tokens = 0
+        self._inserts = 0
+
+    def _create_tables(self, db):
+        db.execute("CREATE TABLE IF NOT EXISTS responses "
+                   "(key TEXT PRIMARY KEY, content TEXT NOT NULL, prompt_tokens INTEGER, completion_tokens INTEGER, "
+                   "created REAL NOT NULL, last_access REAL NOT NULL)")
+        db.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+
+    @staticmethod
+    def fingerprint(model, messages, max_tokens, **options):
+        payload = json.dumps({"model": model, "messages": messages, "max_tokens": max_tokens, **options},
+                             sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached response content for this fingerprint, or None if missing or expired.
+        """
+        now = time.time()
+        try:
+            with self._lock:
+                db = self._db()
+                row = db.execute("SELECT content, prompt_tokens, completion_tokens, created FROM responses "
+                                 "WHERE key = ?", (key,)).fetchone()
+                if row and now - row[3] > self.ttl_seconds:
+                    db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    row = None
+                if row is None:
+                    self.misses += 1
+                    return None
+                db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                self.hits += 1
+                self.saved_prompt_tokens += row[1] or 0
+                self.saved_completion_tokens += row[2] or 0
+            return row[0]
+        except sqlite3.Error as e:
+            logging.warning(f"Response cache lookup failed: {e}")
+            return None
+
+    def put(self, key, content, usage=None):
+        now = time.time()
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        completion_tokens = getattr(usage, "completion_tokens", None)
+        try:
+            with self._lock:
+                db = self._db()
+                db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                           (key, content, prompt_tokens, completion_tokens, now, now))
+                self._inserts += 1
+                # Expire and trim in bulk every few hundred inserts rather than on each one
+                if self._inserts % 256 == 1:
+                    self._evict(db, now)
+        except sqlite3.Error as e:
+            logging.warning(f"Response cache store failed: {e}")
+
+    def _evict(self, db, now):
+        db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+        excess = db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+        if excess > 0:
+            db.execute("DELETE FROM responses WHERE key IN "
+                       "(SELECT key FROM responses ORDER BY last_access LIMIT ?)", (excess,))
+
+    def report(self):
+        if self.hits or self.misses:
+            logging.info(f"LLM response cache: {self.hits} hits, {self.misses} misses, saved "
+                         f"{self.saved_prompt_tokens} prompt and {self.saved_completion_tokens} completion tokens")
+
+
+class RunJournal(_SqliteStore):
+    """
+    Crash-safe journal of the files processed by autoRename, so an interrupted run can be resumed.
+
+    Each file moves through the states extracted, titled and renamed. The latest state of every file is
+    kept by path, along with its size, mtime and content hash, and every transition is also appended to
+    an events table as a history of the runs. A file only matches its entry while its size and mtime are
+    unchanged, so lookups cost one indexed query and a stat, without re-hashing the file.
+    """
+
+    def __init__(self, cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+        super().__init__(os.path.join(cache_dir, "journal.sqlite3"))
+        self.run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+
+    def _create_tables(self, db):
+        # Each transition is committed to disk before the next step starts, a crash loses at most the step in flight
+        db.execute("PRAGMA synchronous=FULL")
+        db.execute("CREATE TABLE IF NOT EXISTS files "
+                   "(path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, digest TEXT NOT NULL, "
+                   "state TEXT NOT NULL, title TEXT, updated REAL NOT NULL)")
+        db.execute("CREATE TABLE IF NOT EXISTS events "
+                   "(id INTEGER PRIMARY KEY AUTOINCREMENT, run_id TEXT NOT NULL, path TEXT NOT NULL, "
+                   "digest TEXT NOT NULL, state TEXT NOT NULL, title TEXT, new_path TEXT, time REAL NOT NULL)")
+
+    def lookup(self, file_path, stat=None):
+        """
+        Returns (state, title) of the file if the journal has an entry for it in its current version, else None.
+        `stat` saves a system call when the caller already has the stat result of the file.
+        """
+        try:
+            path = os.path.abspath(file_path)
+            stat = stat or os.stat(path)
+            with self._lock:
+                row = self._db().execute("SELECT size, mtime_ns, state, title FROM files WHERE path = ?",
+                                         (path,)).fetchone()
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"Run journal lookup failed for {file_path}: {e}")
+            return None
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2], row[3]
+        return None
+
+    def record(self, file_path, state, title=None, new_path=None, digest=None):
+        """
+        Records that the file reached this state; a renamed file is tracked under new_path from then on.
+        `digest` is the content hash of the file when the caller already computed it, which saves reading it here.
+        """
+        try:
+            path = os.path.abspath(file_path)
+            current_path = os.path.abspath(new_path) if new_path else path
+            stat = os.stat(current_path)
+            if digest is None:
+                with self._lock:
+                    row = self._db().execute("SELECT size, mtime_ns, digest FROM files WHERE path = ?",
+                                             (path,)).fetchone()
+                if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+                    digest = row[2]
+                else:
+                    digest = content_hash(current_path)
+
+            now = time.time()
+            with self._lock:
+                db = self._db()
+                db.execute("BEGIN IMMEDIATE")
+                try:
+                    db.execute("DELETE FROM files WHERE path = ?", (path,))
+                    db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (current_path, stat.st_size, stat.st_mtime_ns, digest, state, title, now))
+                    db.execute("INSERT INTO events (run_id, path, digest, state, title, new_path, time) "
+                               "VALUES (?, ?, ?, ?, ?, ?, ?)", (self.run_id, path, digest, state, title,
+                                                               new_path and current_path, now))
+                    db.execute("COMMIT")
+                except sqlite3.Error:
+                    db.execute("ROLLBACK")
+                    raise
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"Run journal update failed for {file_path}: {e}")
@@ -0,0 +1,205 @@
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from multiprocessing.connection import wait as wait_for_connections
+
+
+def _run_extraction(function, file_path, kwargs):
+    try:
+        return file_path, function(file_path, **kwargs), None
+    except Exception as e:
+        return file_path, None, f"{type(e).__name__}: {e}"
+
+
+def _extract_chunk(function, file_paths, kwargs):
+    """
+    Runs the extraction function over a chunk of files inside a worker process.
+    Errors are returned as text so a failing file never breaks the rest of its chunk.
+    """
+    return [_run_extraction(function, file_path, kwargs) for file_path in file_paths]
+
+
+def _watched_worker(connection, initializer):
+    """
+    Main loop of a killable worker: receives one (function, file_path, kwargs) task at a time until None.
+    """
+    if initializer:
+        initializer()
+    while (task := connection.recv()) is not None:
+        connection.send(_run_extraction(*task))
+
+
+class _WatchedWorker:
+    def __init__(self, context, initializer):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=_watched_worker, args=(child_connection, initializer), daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.task = None
+        self.deadline = None
+
+    def start(self, task, timeout):
+        function, file_path, kwargs, _ = task
+        self.connection.send((function, file_path, kwargs))
+        self.task = task
+        self.deadline = time.monotonic() + timeout
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+
+
+class ExtractionEngine:
+    """
+    Runs a PDF extraction function in a pool of worker processes, which unlike threads
+    lets pure-Python parsers such as pdfminer use every core.
+
+    Files are submitted in chunks of chunk_size, with at most max_pending_chunks chunks queued at once,
+    so the input can be a lazy iterable of any length. Each worker runs `initializer` once on start-up
+    to warm up whatever the extraction needs (tokenizer models, imports).
+
+    With a timeout, files are handed out one at a time and a worker still busy with a file after
+    `timeout` seconds is killed and replaced. A file that timed out or failed is then retried once
+    with `fallback`, a cheaper extraction function, if one is given. Files that still fail are listed
+    in `failures`.
+
+    start_method selects how worker processes are started ("fork", "spawn" or "forkserver", default: the
+    platform's). Callers running other threads, such as an event loop, should not fork them.
+    """
+
+    def __init__(self, workers=None, chunk_size=2, max_pending_chunks=None, initializer=None, timeout=None,
+                 fallback=None, start_method=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.max_pending_chunks = max_pending_chunks or self.workers * 2
+        self.initializer = initializer
+        self.timeout = timeout
+        self.fallback = fallback
+        self.start_method = start_method
+        self.failures = []
+
+    def imap_unordered(self, function, file_paths, **kwargs):
+        """
+        Yields (file_path, result, error) for every file, in the order the extractions complete.
+        `function` must be a module-level function so it can be sent to the workers.
+        """
+        if self.timeout:
+            results = self._imap_watched(function, file_paths, kwargs)
+        else:
+            results = self._imap_pooled(function, file_paths, kwargs)
+        for file_path, result, error in results:
+            if error:
+                self.failures.append((file_path, error))
+            yield file_path, result, error
+
+    def _imap_pooled(self, function, file_paths, kwargs):
+        file_paths = iter(file_paths)
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(self.start_method),
+                                 initializer=self.initializer) as executor:
+            pending = {}
+
+            def submit_more():
+                while len(pending) < self.max_pending_chunks:
+                    chunk = list(islice(file_paths, self.chunk_size))
+                    if not chunk:
+                        return
+                    pending[executor.submit(_extract_chunk, function, chunk, kwargs)] = chunk
+
+            submit_more()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                chunks = {future: pending.pop(future) for future in done}
+                submit_more()
+                for future, chunk in chunks.items():
+                    try:
+                        yield from future.result()
+                    except Exception as e:
+                        # The worker process itself died, every file of its chunk is reported as failed
+                        logging.error(f"Extraction worker failed: {e}")
+                        yield from ((file_path, None, f"{type(e).__name__}: {e}") for file_path in chunk)
+
+    def _imap_watched(self, function, file_paths, kwargs):
+        context = multiprocessing.get_context(self.start_method)
+        file_paths = iter(file_paths)
+        retries = deque()  # Fallback tasks of the files that timed out or failed
+        workers = [_WatchedWorker(context, self.initializer) for _ in range(self.workers)]
+
+        def next_task():
+            if retries:
+                return retries.popleft()
+            file_path = next(file_paths, None)
+            return None if file_path is None else (function, file_path, kwargs, False)
+
+        def failed(task, error):
+            # The first failure of a file gets one more try with the fallback extraction
+            _, file_path, task_kwargs, is_fallback = task
+            if self.fallback and not is_fallback:
+                logging.warning(f"{error} on {file_path}, retrying with the fallback extraction")
+                retries.append((self.fallback, file_path, task_kwargs, True))
+                return None
+            return file_path, None, error
+
+        try:
+            while True:
+                for worker in workers:
+                    if worker.task is None and (task := next_task()) is not None:
+                        worker.start(task, self.timeout)
+                busy = [worker for worker in workers if worker.task is not None]
+                if not busy:
+                    return
+
+                wait_time = max(0.0, min(worker.deadline for worker in busy) - time.monotonic())
+                ready = wait_for_connections([worker.connection for worker in busy], timeout=wait_time)
+                for index, worker in enumerate(workers):
+                    if worker.task is None:
+                        continue
+                    if worker.connection in ready:
+                        try:
+                            result = worker.connection.recv()
+                        except (EOFError, OSError):
+                            result = failed(worker.task, "Extraction worker crashed")
+                            worker.kill()
+                            workers[index] = _WatchedWorker(context, self.initializer)
+                        else:
+                            if result[2]:
+                                result = failed(worker.task, result[2])
+                            worker.task = None
+                    elif time.monotonic() >= worker.deadline:
+                        result = failed(worker.task, f"Extraction timed out after {self.timeout}s")
+                        worker.kill()
+                        workers[index] = _WatchedWorker(context, self.initializer)
+                    else:
+                        continue
+                    if result is not None:
+                        yield result
+        finally:
+            for worker in workers:
+                if worker.task is not None:
+                    worker.kill()
+                else:
+                    worker.stop()
+
+
+def write_quarantine_report(failures, report_path):
+    """
+    Appends the files whose extraction failed to a JSON lines report, one {"file", "error"} object per line.
+    """
+    with open(report_path, 'a', encoding='utf-8') as report:
+        for file_path, error in failures:
+            report.write(json.dumps({"file": file_path, "error": error}) + "\n")
+    logging.warning(f"Quarantined {len(failures)} files that could not be extracted, see {report_path}")
@@ -0,0 +1,357 @@
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+
+from diskCache import content_hash
+
+CONFLICT_POLICIES = ["suffix", "skip", "hash", "overwrite", "ask"]
+SUFFIX_PATTERN = re.compile(r' \((\d+)\)$')
+HASH_PATTERN = re.compile(r' \[[0-9a-f]{8}\]$')
+TRASH_DIR_NAME = ".trash"
+UNDO_LOG_NAME = "undo.jsonl"
+
+
+def rename_no_clobber(file_path, new_file_path):
+    """
+    Renames the file, raising FileExistsError instead of replacing an existing file at new_file_path.
+    """
+    if os.name == "nt":
+        # Windows renames already refuse to replace an existing file
+        os.rename(file_path, new_file_path)
+        return
+    try:
+        # Linking fails atomically if the target exists, where os.rename would silently replace it
+        os.link(file_path, new_file_path)
+    except FileExistsError:
+        raise
+    except OSError:
+        # File systems without hard links, or another device: check then move, which only races with other writers
+        if os.path.lexists(new_file_path):
+            raise FileExistsError(f"File exists: '{new_file_path}'")
+        shutil.move(file_path, new_file_path)
+        return
+    os.unlink(file_path)
+
+
+class UndoLog:
+    """
+    Append-only JSON lines log of the renames and deletions made by a run, one compact
+    {"run", "op", "from", "to"} object per line, so the whole run can be rolled back with undo_run.
+
+    Lines are flushed as they are written and synced to disk every sync_every operations and on close,
+    which keeps logging cheap on runs of tens of thousands of files.
+    """
+
+    def __init__(self, log_path, command=None, sync_every=256):
+        self.log_path = log_path
+        self.command = command
+        self.sync_every = sync_every
+        self.run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.count = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _write(self, entry):
+        if self._file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.log_path)), exist_ok=True)
+            self._file = open(self.log_path, 'a', encoding='utf-8')
+            self._file.write(json.dumps({"run": self.run_id, "op": "begin", "time": time.time(),
+                                         "command": self.command}) + "\n")
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def record(self, op, source, target):
+        """
+        Logs that the file at source was moved to target, as a "rename" or as a "trash" deletion.
+        """
+        with self._lock:
+            self._write({"run": self.run_id, "op": op, "from": os.path.abspath(source), "to": os.path.abspath(target)})
+            self.count += 1
+            if self.count % self.sync_every == 0:
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+        if self.count:
+            logging.info(f"Logged {self.count} file operations as run {self.run_id}, "
+                         f"revert them with: python fileOps.py --log \"{self.log_path}\" undo")
+
+
+def read_undo_log(log_path):
+    """
+    Returns ({run_id: [entries]} in the order the runs were logged, set of the run_ids already undone).
+    """
+    runs, undone = {}, set()
+    with open(log_path, 'r', encoding='utf-8') as log:
+        for line in log:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # A line cut short by a crash
+            if entry["op"] == "undone":
+                undone.add(entry["run"])
+            else:
+                runs.setdefault(entry["run"], []).append(entry)
+    return runs, undone
+
+
+def undo_run(log_path, run_id=None, dry_mode=False):
+    """
+    Reverts the renames and deletions of a logged run (the latest one not undone yet by default), newest first:
+    renamed files get their former name back and trashed files come back from the trash. Nothing is replaced;
+    an operation whose former name is taken again is reported and left as it is.
+    Returns (number of operations reverted, number that could not be).
+    """
+    runs, undone = read_undo_log(log_path)
+    if run_id is None:
+        pending = [run for run in runs if run not in undone]
+        if not pending:
+            logging.info("Nothing to undo")
+            return 0, 0
+        run_id = pending[-1]
+    elif run_id not in runs:
+        raise ValueError(f"Run {run_id} is not in {log_path}")
+    elif run_id in undone:
+        logging.warning(f"Run {run_id} was already undone")
+
+    reverted = failed = 0
+    for entry in reversed(runs[run_id]):
+        if entry["op"] not in ("rename", "trash"):
+            continue
+        try:
+            if dry_mode:
+                logging.info(f"[DRY MODE] Would move {entry['to']} back to {entry['from']}")
+            else:
+                rename_no_clobber(entry["to"], entry["from"])
+            reverted += 1
+        except OSError as e:
+            logging.error(f"Could not move {entry['to']} back to {entry['from']}: {e}")
+            failed += 1
+
+    if not dry_mode:
+        with open(log_path, 'a', encoding='utf-8') as log:
+            log.write(json.dumps({"run": run_id, "op": "undone", "time": time.time()}) + "\n")
+            log.flush()
+            os.fsync(log.fileno())
+    logging.info(f"{'[DRY MODE] Would undo' if dry_mode else 'Undid'} run {run_id}: {reverted} operations reverted, "
+                 f"{failed} failed")
+    return reverted, failed
+
+
+def move_to_trash(file_path, trash_dir=None, undo_log=None):
+    """
+    Deletes a file by moving it into trash_dir (by default a .trash folder next to it, on the same disk),
+    logging the move so undo_run can bring it back. Returns the path of the file in the trash.
+    """
+    trash_dir = trash_dir or os.path.join(os.path.dirname(os.path.abspath(file_path)), TRASH_DIR_NAME)
+    os.makedirs(trash_dir, exist_ok=True)
+    stem, extension = os.path.splitext(os.path.basename(file_path))
+    trash_path = os.path.join(trash_dir, stem + extension)
+    number = 2
+    while True:
+        try:
+            rename_no_clobber(file_path, trash_path)
+            break
+        except FileExistsError:
+            trash_path = os.path.join(trash_dir, f"{stem} ({number}){extension}")
+            number += 1
+    if undo_log:
+        undo_log.record("trash", file_path, trash_path)
+    return trash_path
+
+
+def is_same_file(file_path, other_path):
+    if os.path.normcase(os.path.abspath(file_path)) == os.path.normcase(os.path.abspath(other_path)):
+        return True
+    try:
+        return os.path.samefile(file_path, other_path)
+    except OSError:
+        return False
+
+
+class RenameResolver:
+    """
+    Renames files without ever replacing an existing one, unless the on_conflict policy says so:
+    'suffix' adds " (2)", " (3)"... to the name, 'hash' adds a short content hash, 'skip' leaves the file
+    as it is, 'overwrite' moves the existing file to the trash first and 'ask' prompts for what to do.
+    With an undo_log, every rename and deletion is logged so the run can be undone.
+
+    The names taken in each directory are listed once and kept in memory along with the renames made
+    so far, so a free name is found without touching the disk; the no-clobber rename itself still
+    catches files created behind our back.
+    """
+
+    def __init__(self, on_conflict="suffix", undo_log=None, trash_dir=None):
+        if on_conflict not in CONFLICT_POLICIES:
+            raise ValueError(f"Unknown conflict policy {on_conflict!r}, expected one of {', '.join(CONFLICT_POLICIES)}")
+        self.on_conflict = on_conflict
+        self.undo_log = undo_log
+        self.trash_dir = trash_dir
+        self._taken = {}
+        self._suffixes = {}  # Last suffix number handed out per name, so thousands of equal titles stay linear
+        self._lock = threading.Lock()
+
+    def _taken_names(self, directory):
+        directory = os.path.abspath(directory)
+        if directory not in self._taken:
+            self._taken[directory] = {os.path.normcase(name) for name in os.listdir(directory)}
+        return self._taken[directory]
+
+    def _move(self, file_path, new_file_path, replace=False):
+        if replace and os.path.lexists(new_file_path):
+            move_to_trash(new_file_path, self.trash_dir, self.undo_log)
+        rename_no_clobber(file_path, new_file_path)
+        if self.undo_log:
+            self.undo_log.record("rename", file_path, new_file_path)
+
+    def _is_variant(self, file_path, new_file_path):
+        # True if the file already has one of the names the policy would pick, e.g. "Title (2).pdf" from an earlier run
+        stem, extension = os.path.splitext(os.path.normcase(os.path.abspath(new_file_path)))
+        source_stem, source_extension = os.path.splitext(os.path.normcase(os.path.abspath(file_path)))
+        if self.on_conflict not in ("suffix", "hash") or source_extension != extension:
+            return False
+        source_stem = SUFFIX_PATTERN.sub("", source_stem)
+        if self.on_conflict == "hash":
+            source_stem = HASH_PATTERN.sub("", source_stem)
+        return source_stem == SUFFIX_PATTERN.sub("", stem)
+
+    def _candidates(self, file_path, new_file_path):
+        yield new_file_path
+        if self.on_conflict not in ("suffix", "hash"):
+            return
+        stem, extension = os.path.splitext(new_file_path)
+        if self.on_conflict == "hash":
+            stem = f"{stem} [{content_hash(file_path)[:8]}]"
+            yield stem + extension
+        else:
+            # Continue from an existing suffix rather than stacking "Title (2) (2)"
+            match = SUFFIX_PATTERN.search(stem)
+            if match:
+                stem = stem[:match.start()]
+        key = os.path.normcase(os.path.abspath(stem))
+        number = self._suffixes.get(key, 2)
+        while True:
+            self._suffixes[key] = number
+            yield f"{stem} ({number}){extension}"
+            number += 1
+
+    def rename(self, file_path, new_file_path, dry_mode=False):
+        """
+        Renames file_path to new_file_path, or to the name the policy picks if that one is taken.
+        Returns the final path, or None if the file keeps its name. In dry_mode the names are only reserved.
+        """
+        if is_same_file(file_path, new_file_path):
+            if not dry_mode and os.path.basename(file_path) != os.path.basename(new_file_path):
+                os.rename(file_path, new_file_path)  # Only the case of the name changes
+                if self.undo_log:
+                    self.undo_log.record("rename", file_path, new_file_path)
+            return new_file_path
+        if self._is_variant(file_path, new_file_path):
+            return file_path
+
+        same_directory = os.path.dirname(os.path.abspath(file_path)) == os.path.dirname(os.path.abspath(new_file_path))
+        with self._lock:
+            taken = self._taken_names(os.path.dirname(new_file_path))
+            final_path = None
+            for candidate in self._candidates(file_path, new_file_path):
+                name = os.path.normcase(os.path.basename(candidate))
+                if name not in taken:
+                    try:
+                        if not dry_mode:
+                            self._move(file_path, candidate)
+                    except FileExistsError:
+                        taken.add(name)  # Created by someone else since the directory was listed
+                    else:
+                        taken.add(name)
+                        final_path = candidate
+                        break
+                if self.on_conflict not in ("suffix", "hash"):
+                    final_path = self._resolve_taken(file_path, candidate, dry_mode)
+                    break
+            if same_directory and (final_path is not None or not os.path.lexists(file_path)):
+                taken.discard(os.path.normcase(os.path.basename(file_path)))
+            return final_path
+
+    def _resolve_taken(self, file_path, new_file_path, dry_mode):
+        original_filename, new_filename = os.path.basename(file_path), os.path.basename(new_file_path)
+        if self.on_conflict == "skip" or (dry_mode and self.on_conflict == "ask"):
+            logging.warning(f"Skipping {original_filename}: {new_filename} already exists")
+            return None
+        if self.on_conflict == "overwrite":
+            logging.warning(f"Replacing the existing {new_filename} with {original_filename}")
+            if not dry_mode:
+                self._move(file_path, new_file_path, replace=True)
+            return new_file_path
+        return self._ask(file_path, new_file_path)
+
+    def _ask(self, file_path, new_file_path):
+        directory, original_filename = os.path.split(file_path)
+        logging.error(f"Cannot rename file {original_filename} to {os.path.basename(new_file_path)}: "
+                      f"the file already exists")
+        while True:
+            todo = input(
+                "Enter 'r' to rename, 's' to skip, 'q' to quit, 'o' to open both files, d to delete current file, e to erase the existent file: ")
+            if todo == "r":
+                chosen_path = os.path.join(directory, input("Enter new name: "))
+                try:
+                    self._move(file_path, chosen_path)
+                except FileExistsError:
+                    logging.error(f"{os.path.basename(chosen_path)} exists as well")
+                    continue
+                self._taken_names(directory).add(os.path.normcase(os.path.basename(chosen_path)))
+                return chosen_path
+            elif todo == "s":
+                return None
+            elif todo == "e":
+                # erase the existing file (moved to the trash)
+                self._move(file_path, new_file_path, replace=True)
+                return new_file_path
+            elif todo == "d":
+                # delete the file (moved to the trash)
+                move_to_trash(file_path, self.trash_dir, self.undo_log)
+                return None
+            elif todo == "q":
+                sys.exit()
+            elif todo == "o":
+                # open both file with default application
+                os.startfile(new_file_path)
+                os.startfile(file_path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+
+    parser = argparse.ArgumentParser(description="Lists and reverts the renames and deletions logged by the scripts.")
+    parser.add_argument("--log", type=str, default=os.path.join(script_dir, ".cache", UNDO_LOG_NAME),
+                        help="Undo log to read, undo.jsonl in the --cache_dir of the run (default: .cache next to "
+                             "the scripts)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("runs", help="List the logged runs")
+    undo_parser = subparsers.add_parser("undo", help="Revert the renames and deletions of a run")
+    undo_parser.add_argument("--run", type=str, help="ID of the run to revert (default: the latest one not undone)")
+    undo_parser.add_argument("--dry_mode", action="store_true",
+                             help="If set, only log the moves that would be made")
+    args = parser.parse_args()
+
+    if args.command == "runs":
+        runs, undone = read_undo_log(args.log)
+        for run_id, entries in runs.items():
+            begin = next((entry for entry in entries if entry["op"] == "begin"), {})
+            started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(begin["time"])) if "time" in begin else "?"
+            counts = {op: sum(entry["op"] == op for entry in entries) for op in ("rename", "trash")}
+            logging.info(f"{run_id}  {started}  {begin.get('command') or '?'}: {counts['rename']} renames, "
+                         f"{counts['trash']} deletions{' (undone)' if run_id in undone else ''}")
+    else:
+        _, failed = undo_run(args.log, args.run, args.dry_mode)
+        sys.exit(1 if failed else 0)
@@ -0,0 +1,137 @@
+import fnmatch
+import logging
+import os
+import re
+
+GLOB_MAGIC_PATTERN = re.compile(r'[*?[]')
+
+
+def split_pattern(file_pattern):
+    """
+    Splits a glob pattern into the directory to walk, made of its components without wildcards,
+    and the pattern the paths below that directory must match.
+    """
+    parts = file_pattern.replace(os.sep, "/").split("/")
+    for index, part in enumerate(parts):
+        if GLOB_MAGIC_PATTERN.search(part):
+            root = "/".join(parts[:index])
+            if not root and file_pattern.startswith(("/", os.sep)):
+                root = "/"
+            return root, "/".join(parts[index:])
+    return file_pattern, None
+
+
+def compile_pattern(pattern):
+    """
+    Translates a glob pattern into a case-insensitive regex over '/'-separated relative paths:
+    '**/' matches any number of directories, while '*', '?' and '[...]' stay within one path component.
+    """
+    regex = []
+    index = 0
+    while index < len(pattern):
+        if pattern.startswith("**/", index):
+            regex.append("(?:.*/)?")
+            index += 3
+            continue
+        if pattern.startswith("**", index):
+            regex.append(".*")
+            index += 2
+            continue
+        char = pattern[index]
+        index += 1
+        if char == "*":
+            regex.append("[^/]*")
+        elif char == "?":
+            regex.append("[^/]")
+        elif char == "[" and (end := pattern.find("]", index + (2 if pattern.startswith("!", index) else 1))) != -1:
+            chars = pattern[index:end]
+            negate = chars.startswith("!")
+            # '-' keeps its range meaning, only the characters special inside a regex set are escaped
+            chars = re.sub(r'([\\\][&~|]|^\^)', r'\\\1', chars[1:] if negate else chars)
+            regex.append(f"[^/{chars}]" if negate else f"[{chars}]")
+            index = end + 1
+        else:
+            regex.append(re.escape(char))
+    return re.compile("".join(regex) + r"\Z", re.IGNORECASE)
+
+
+def compile_filters(patterns):
+    # Patterns with a '/' are matched against the relative path, the others against the name alone
+    return [(("/" in pattern), re.compile(fnmatch.translate(pattern), re.IGNORECASE)) for pattern in patterns or []]
+
+
+def matches_any(filters, relative_path, name):
+    return any(regex.match(relative_path if on_path else name) for on_path, regex in filters)
+
+
+def walk_files(file_pattern, include=None, exclude=None, extensions=(".pdf",), follow_symlinks=True):
+    """
+    Streams (path, stat_result) for the files matching file_pattern, a file, a directory (walked
+    recursively) or a glob pattern where '**' recurses into subdirectories. Files come out as each
+    directory is scanned, in name order, so processing starts without enumerating the whole tree.
+
+    Extensions and patterns are matched case-insensitively, so "*.pdf" also finds ".PDF" files.
+    include and exclude are lists of extra glob patterns; excluded directories are not entered.
+    Hidden files and directories are skipped, as glob does, and symlinked directories are followed
+    once each, so symlink loops end. The stat results come from the scan and can be reused downstream.
+    """
+    extensions = tuple(extension.lower() for extension in extensions)
+    includes, excludes = compile_filters(include), compile_filters(exclude)
+
+    if os.path.isfile(file_pattern):
+        if file_pattern.lower().endswith(extensions):
+            yield file_pattern, os.stat(file_pattern)
+        return
+
+    root, pattern = split_pattern(file_pattern)
+    if pattern is None and not os.path.isdir(root):
+        logging.warning(f"No such file or directory: {file_pattern}")
+        return
+    regex = compile_pattern(pattern) if pattern else None
+    # Without '**', a pattern only reaches as many directories down as it has components
+    max_depth = None if pattern is None or "**" in pattern else pattern.count("/")
+
+    try:
+        root_stat = os.stat(root or ".")
+    except OSError as e:
+        logging.warning(f"Cannot read directory {root}: {e}")
+        return
+    visited = {(root_stat.st_dev, root_stat.st_ino)}
+    stack = [(root, "", 0)]
+    while stack:
+        directory, relative_directory, depth = stack.pop()
+        try:
+            with os.scandir(directory or ".") as scanned:
+                entries = sorted(scanned, key=lambda entry: entry.name)
+        except OSError as e:
+            logging.warning(f"Cannot read directory {directory}: {e}")
+            continue
+
+        subdirectories = []
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            relative_path = relative_directory + entry.name
+            path = os.path.join(directory, entry.name) if directory else entry.name
+            try:
+                if entry.is_dir(follow_symlinks=follow_symlinks):
+                    if (max_depth is not None and depth >= max_depth) or matches_any(excludes, relative_path,
+                                                                                       entry.name):
+                        continue
+                    stat = entry.stat(follow_symlinks=follow_symlinks)
+                    if (stat.st_dev, stat.st_ino) in visited:
+                        logging.warning(f"Skipping {path}, already walked (symlink loop?)")
+                        continue
+                    visited.add((stat.st_dev, stat.st_ino))
+                    subdirectories.append((path, relative_path + "/", depth + 1))
+                elif entry.name.lower().endswith(extensions) and entry.is_file(follow_symlinks=follow_symlinks):
+                    if regex and not regex.match(relative_path):
+                        continue
+                    if includes and not matches_any(includes, relative_path, entry.name):
+                        continue
+                    if matches_any(excludes, relative_path, entry.name):
+                        continue
+                    yield path, entry.stat(follow_symlinks=follow_symlinks)
+            except OSError as e:
+                logging.warning(f"Cannot read {path}: {e}")
+        stack.extend(reversed(subdirectories))
@@ -0,0 +1,77 @@
+import json
+import os
+
+from retryEngine import RetryEngine
+
+
+def load_api_key(api_key_path):
+    """
+    Loads the OpenAI API key from a .secret JSON file, or returns None if there is no such file.
+    """
+    if not os.path.exists(api_key_path):
+        return None
+    with open(api_key_path, 'r') as secret_file:
+        secrets = json.load(secret_file)
+        return secrets['openai_api_key']
+
+
+class ChatBackend:
+    """
+    Chat-completions endpoint used by the scripts: the OpenAI API by default, or any server speaking
+    the same protocol at base_url, such as a local model server or llmStandIn.py for offline runs.
+
+    Nothing is read or imported until the first request: the API key is loaded from api_key_path
+    (falling back to the OPENAI_API_KEY environment variable), and the sync and async clients are
+    created on first use. The async client belongs to the event loop that first used it, so aclose()
+    must be awaited before that loop ends.
+
+    Retries are left to retry_engine, shared by every call of the backend, so the SDK's own retries are
+    disabled and each attempt gives up after timeout seconds.
+    """
+
+    def __init__(self, api_key=None, base_url=None, api_key_path=None, retry_engine=None, timeout=60.0):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.api_key_path = api_key_path
+        self.retry_engine = retry_engine or RetryEngine()
+        self.timeout = timeout
+        self._client = None
+        self._async_client = None
+
+    def _client_options(self):
+        if self.api_key is None and self.api_key_path:
+            self.api_key = load_api_key(self.api_key_path)
+        api_key = self.api_key or os.environ.get("OPENAI_API_KEY")
+        if not api_key:
+            if not self.base_url:
+                raise ValueError(f"No OpenAI API key found, write it to {self.api_key_path or 'a .secret file'} "
+                                 f"as {{\"openai_api_key\": \"...\"}} or set OPENAI_API_KEY")
+            # Local servers usually ignore the key, but the OpenAI client refuses to start without one
+            api_key = "local"
+        return {"api_key": api_key, "base_url": self.base_url, "max_retries": 0, "timeout": self.timeout}
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(**self._client_options())
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            from openai import AsyncOpenAI
+            self._async_client = AsyncOpenAI(**self._client_options())
+        return self._async_client
+
+    def complete(self, model, messages, max_tokens, **options):
+        return self.client.chat.completions.create(model=model, messages=messages, max_tokens=max_tokens, **options)
+
+    async def complete_async(self, model, messages, max_tokens, **options):
+        return await self.async_client.chat.completions.create(model=model, messages=messages,
+                                                               max_tokens=max_tokens, **options)
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
@@ -0,0 +1,207 @@
+import argparse
+import json
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+WORD_PATTERN = re.compile(r'\w+')
+FILE_LINE_PATTERN = re.compile(r'^File (\S+): (.*)$')
+DOCUMENT_PATTERN = re.compile(r'^Document (\d+):\n(.*?)(?=\n\nDocument \d+:\n|\Z)', re.DOTALL | re.MULTILINE)
+
+
+class StandInBehavior:
+    """
+    How the stand-in server answers: latency drawn uniformly in latency +/- latency_jitter seconds,
+    a share of requests failing with 500 or 429, and a real requests-per-minute limit answered with 429.
+    """
+
+    def __init__(self, latency=0.2, latency_jitter=0.1, error_rate=0.0, rate_limit_rate=0.0, retry_after=1.0,
+                 rpm=None, seed=None):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.rpm = rpm
+        self.random = random.Random(seed)
+        self.recent_requests = deque()
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    def admit(self):
+        """
+        Decides the fate of an incoming request: returns (status, retry_after) where status is 200, 429 or 500.
+        """
+        with self._lock:
+            self.stats["requests"] += 1
+            now = time.monotonic()
+            if self.rpm:
+                while self.recent_requests and now - self.recent_requests[0] >= 60:
+                    self.recent_requests.popleft()
+                if len(self.recent_requests) >= self.rpm:
+                    self.stats["rate_limited"] += 1
+                    return 429, 60 - (now - self.recent_requests[0])
+                self.recent_requests.append(now)
+            draw = self.random.random()
+            if draw < self.rate_limit_rate:
+                self.stats["rate_limited"] += 1
+                return 429, self.retry_after
+            if draw < self.rate_limit_rate + self.error_rate:
+                self.stats["errors"] += 1
+                return 500, None
+            self.stats["completed"] += 1
+            return 200, None
+
+    def delay(self):
+        with self._lock:
+            jitter = self.random.uniform(-self.latency_jitter, self.latency_jitter)
+        return max(0.0, self.latency + jitter)
+
+
+def make_title(text):
+    words = WORD_PATTERN.findall(text.split("Extracted content:", 1)[-1])
+    return " ".join(word.capitalize() for word in words[:6]) or "Untitled Document"
+
+
+def answer(messages, response_format=None):
+    """
+    Builds a deterministic answer for the request: the duplicate files of each group when the prompt
+    lists 'File <id>: <snippet>' lines (files whose snippets are identical), as text or as JSON
+    clusters when a JSON schema is requested; a JSON object of titles when a JSON answer is requested
+    for 'Document <id>:' blocks; otherwise a title made from the first words of the last message.
+    """
+    prompt = messages[-1]["content"] if messages else ""
+    if response_format == "json_object":
+        return json.dumps({"titles": {number: make_title(text) for number, text in DOCUMENT_PATTERN.findall(prompt)}})
+    groups = [[]]
+    for line in prompt.splitlines():
+        if line.startswith("Group "):
+            groups.append([])
+        elif match := FILE_LINE_PATTERN.match(line):
+            groups[-1].append((match.group(1), match.group(2).strip().lower()))
+    if any(groups):
+        clusters = []
+        for group in groups:
+            by_text = {}
+            for file_id, text in group:
+                by_text.setdefault(text, []).append(file_id)
+            clusters.extend(file_ids for file_ids in by_text.values() if len(file_ids) > 1)
+        if response_format == "json_schema":
+            return json.dumps({"clusters": [{"file_ids": file_ids, "confidence": 0.95} for file_ids in clusters]})
+        pairs = [f"File {file_ids[0]} and File {other} are duplicates"
+                 for file_ids in clusters for other in file_ids[1:]]
+        return "\n".join(pairs) or "No duplicates found."
+    return make_title(prompt)
+
+
+def make_handler(behavior):
+    class StandInHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/stats"):
+                with behavior._lock:
+                    self.send_json(200, dict(behavior.stats))
+            else:
+                self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "not_found"}})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "not_found"}})
+                return
+            try:
+                request = json.loads(body)
+                messages = request["messages"]
+            except (ValueError, KeyError) as e:
+                self.send_json(400, {"error": {"message": f"Invalid request: {e}", "type": "invalid_request_error"}})
+                return
+
+            status, retry_after = behavior.admit()
+            if status == 429:
+                self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                               "code": "rate_limit_exceeded"}},
+                               {"retry-after": f"{retry_after:.3f}", "retry-after-ms": str(int(retry_after * 1000))})
+                return
+
+            time.sleep(behavior.delay())
+            if status == 500:
+                self.send_json(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+                return
+
+            response_format = request.get("response_format") or {}
+            content = answer(messages, response_format.get("type"))
+            prompt_tokens = sum(len(message.get("content") or "") for message in messages) // 4
+            completion_tokens = len(content) // 4 + 1
+            self.send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "stand-in"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "total_tokens": prompt_tokens + completion_tokens},
+            })
+
+        def send_json(self, status, payload, headers=None):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+    return StandInHandler
+
+
+def serve(host, port, behavior):
+    """
+    Serves the chat-completions protocol on host:port until interrupted, then logs the request counters.
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(behavior))
+    server.daemon_threads = True
+    logging.info(f"Stand-in chat-completions server listening on http://{host}:{server.server_port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logging.info(f"Stand-in server stats: {dict(behavior.stats)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Local OpenAI-compatible chat-completions server for offline runs and benchmarks.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument("--latency", type=float, default=0.2, help="Mean response latency in seconds")
+    parser.add_argument("--latency_jitter", type=float, default=0.1,
+                        help="Maximum deviation from --latency, latencies are drawn uniformly")
+    parser.add_argument("--error_rate", type=float, default=0.0,
+                        help="Share of requests answered with a 500 server error")
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0,
+                        help="Share of requests answered with a 429 rate limit error")
+    parser.add_argument("--retry_after", type=float, default=1.0,
+                        help="Retry-after delay in seconds sent with the injected 429 errors")
+    parser.add_argument("--rpm", type=int,
+                        help="If set, requests beyond this many per minute are answered with 429")
+    parser.add_argument("--seed", type=int, help="Random seed, to replay the same sequence of injected errors")
+    args = parser.parse_args()
+
+    serve(args.host, args.port, StandInBehavior(args.latency, args.latency_jitter, args.error_rate,
+                                                args.rate_limit_rate, args.retry_after, args.rpm, args.seed))
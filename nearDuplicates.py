@@ -0,0 +1,122 @@
+import re
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def shingles(text, shingle_size):
+    """
+    Returns the set of lowercase word n-grams of the text. Texts shorter than one
+    shingle yield a single shingle made of all their words.
+    """
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) <= shingle_size:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)}
+
+
+class MinHashLSH:
+    """
+    Near-duplicate index: each text is reduced to a MinHash signature of num_perm values,
+    and signatures are bucketed by bands of rows so that texts sharing any band become candidates.
+    Adding a text costs O(num_perm * shingles), and candidates come out without comparing every pair.
+    """
+
+    def __init__(self, num_perm=128, bands=32, shingle_size=3, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # a < 2^31 and 32-bit shingle hashes keep a * h + b inside uint64 before the modulo
+        self.a = rng.integers(1, 1 << 31, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 31, num_perm, dtype=np.uint64)
+        self.buckets = [defaultdict(list) for _ in range(bands)]
+        self.signatures = {}
+
+    def signature(self, text):
+        hashes = np.fromiter((zlib.crc32(shingle.encode()) for shingle in shingles(text, self.shingle_size)),
+                             dtype=np.uint64)
+        if not hashes.size:
+            return None
+        permuted = (np.outer(self.a, hashes) + self.b[:, None]) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=1)
+
+    def add(self, key, text):
+        """
+        Indexes the text under key. Texts without any word are ignored.
+        """
+        signature = self.signature(text)
+        if signature is None:
+            return
+        self.signatures[key] = signature
+        for band, buckets in enumerate(self.buckets):
+            buckets[signature[band * self.rows:(band + 1) * self.rows].tobytes()].append(key)
+
+    def similarity(self, key1, key2):
+        """
+        Estimated Jaccard similarity of the shingles of two indexed texts.
+        """
+        return float(np.mean(self.signatures[key1] == self.signatures[key2]))
+
+    def candidate_groups(self):
+        """
+        Returns the groups of keys that share at least one band bucket, as sorted lists.
+        Groups contained in a larger group are dropped, since confirming the larger one covers them.
+        """
+        groups = {frozenset(keys) for buckets in self.buckets for keys in buckets.values() if len(keys) > 1}
+        kept_by_key = defaultdict(list)
+        kept = []
+        for group in sorted(groups, key=len, reverse=True):
+            member = next(iter(group))
+            if any(group <= larger for larger in kept_by_key[member]):
+                continue
+            kept.append(group)
+            for key in group:
+                kept_by_key[key].append(group)
+        return sorted(sorted(group) for group in kept)
+
+
+class DisjointSet:
+    """
+    Union-find over hashable keys, with path halving and union by size,
+    so merging millions of duplicate pairs into clusters stays near-linear.
+    """
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def find(self, key):
+        if key not in self.parent:
+            self.parent[key] = key
+            self.size[key] = 1
+            return key
+        while self.parent[key] != key:
+            self.parent[key] = self.parent[self.parent[key]]
+            key = self.parent[key]
+        return key
+
+    def union(self, key1, key2):
+        root1, root2 = self.find(key1), self.find(key2)
+        if root1 == root2:
+            return
+        if self.size[root1] < self.size[root2]:
+            root1, root2 = root2, root1
+        self.parent[root2] = root1
+        self.size[root1] += self.size[root2]
+
+    def clusters(self):
+        """
+        Returns every set of more than one key, as sorted lists.
+        """
+        members = defaultdict(list)
+        for key in self.parent:
+            members[self.find(key)].append(key)
+        return sorted(sorted(cluster) for cluster in members.values() if len(cluster) > 1)
@@ -0,0 +1,137 @@
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+
+class RateLimiter:
+    """
+    Token-bucket limiter enforcing a requests-per-minute and a tokens-per-minute budget.
+
+    Each call reserves one request and an estimated number of tokens up front and waits
+    until both buckets can cover it. A 429 response pauses every caller for the
+    provider's retry-after delay and halves the effective rate, which then recovers a
+    little on each successful call.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute=None, burst_seconds=10, min_scale=0.1):
+        self.requests = _Bucket(requests_per_minute, burst_seconds)
+        self.tokens = _Bucket(tokens_per_minute, burst_seconds) if tokens_per_minute else None
+        self.scale = 1.0
+        self.min_scale = min_scale
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens):
+        """
+        Reserves one request and `tokens` tokens, returning how many seconds the caller must wait.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = self.requests.take(now, 1, self.scale)
+            if self.tokens:
+                wait = max(wait, self.tokens.take(now, tokens, self.scale))
+            return max(wait, self.blocked_until - now)
+
+    def acquire(self, tokens):
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, tokens):
+        import asyncio
+
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def on_success(self, estimated_tokens, used_tokens=None):
+        """
+        Refunds (or charges) the difference between the estimate and the real usage,
+        and lets the rate creep back up after a 429.
+        """
+        with self._lock:
+            if self.tokens and used_tokens is not None:
+                self.tokens.level += estimated_tokens - used_tokens
+            self.scale = min(1.0, self.scale + 0.05)
+
+    def on_rate_limited(self, retry_after=None):
+        """
+        Pauses every caller for `retry_after` seconds (or a short default) and halves the rate.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.scale = max(self.min_scale, self.scale / 2)
+            self.blocked_until = max(self.blocked_until, now + (retry_after if retry_after is not None else 1.0))
+            # Drop any burst allowance so the callers do not stampede once the pause ends
+            self.requests.level = min(self.requests.level, 0.0)
+            if self.tokens:
+                self.tokens.level = min(self.tokens.level, 0.0)
+        logging.warning(f"Rate limited by the provider, pausing for {retry_after or 1.0:.1f}s "
+                        f"(rate now at {self.scale:.0%} of the budget)")
+
+
+class _Bucket:
+    def __init__(self, per_minute, burst_seconds):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self, now, amount, scale):
+        """
+        Removes `amount` from the bucket, allowing it to go into debt, and returns the
+        time needed to pay that debt back at the scaled refill rate.
+        """
+        rate = self.rate * scale
+        self.level = min(self.capacity, self.level + (now - self.updated) * rate)
+        self.updated = now
+        self.level -= amount
+        return -self.level / rate if self.level < 0 else 0.0
+
+
+def build_rate_limiter(requests_per_minute, tokens_per_minute=None, sleep=None):
+    """
+    Creates the limiter for the command line options. The legacy --sleep value is
+    translated into the equivalent requests-per-minute budget.
+    """
+    if sleep:
+        requests_per_minute = 60.0 / sleep
+    return RateLimiter(requests_per_minute, tokens_per_minute)
+
+
+def estimate_tokens(messages, max_tokens):
+    """
+    Rough token estimate of a chat request: about 4 characters per prompt token plus the completion budget.
+    """
+    prompt_chars = sum(len(message["content"]) for message in messages)
+    return prompt_chars // 4 + 4 * len(messages) + max_tokens
+
+
+def retry_after_seconds(error):
+    """
+    Reads the retry-after delay from the HTTP response attached to an API error, if any.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def is_rate_limit_error(error):
+    return getattr(error, "status_code", None) == 429
@@ -0,0 +1,277 @@
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter, deque
+
+from rateLimiter import is_rate_limit_error, retry_after_seconds
+
+
+class RetryPolicy:
+    """
+    How often and how patiently one class of errors is retried: up to max_attempts calls in all,
+    waiting a random delay between 0 and min(max_delay, base_delay * 2^(retry - 1)) ("full jitter").
+    Errors of a class with trips_breaker count towards opening the circuit breaker.
+    """
+
+    def __init__(self, max_attempts, base_delay=1.0, max_delay=30.0, trips_breaker=False):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.trips_breaker = trips_breaker
+
+    def delay(self, retry):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (retry - 1)))
+
+
+DEFAULT_POLICIES = {
+    "rate_limit": RetryPolicy(8, base_delay=1.0, max_delay=60.0),
+    "server": RetryPolicy(5, base_delay=1.0, max_delay=30.0, trips_breaker=True),
+    "timeout": RetryPolicy(4, base_delay=2.0, max_delay=30.0, trips_breaker=True),
+    "connection": RetryPolicy(5, base_delay=1.0, max_delay=30.0, trips_breaker=True),
+    "client": RetryPolicy(1),
+    "other": RetryPolicy(1),
+}
+
+
+def classify_error(error):
+    """
+    Sorts an API error into one of the DEFAULT_POLICIES classes, without importing the OpenAI SDK.
+    """
+    if is_rate_limit_error(error):
+        return "rate_limit"
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return "server" if status_code >= 500 or status_code in (408, 409) else "client"
+    names = {cls.__name__ for cls in type(error).__mro__}
+    if "APITimeoutError" in names or isinstance(error, TimeoutError):
+        return "timeout"
+    if "APIConnectionError" in names or isinstance(error, ConnectionError):
+        return "connection"
+    return "other"
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive provider failures. While open, callers wait instead of
+    failing, checking again every poll_interval seconds; after cooldown seconds a single probe call is
+    let through, which closes the breaker on success and reopens it for another cooldown on failure.
+    Only the probe closes an open breaker: calls already in flight when it opened do not.
+    """
+
+    def __init__(self, failure_threshold=5, cooldown=30.0, poll_interval=0.5):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.poll_interval = poll_interval
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.opens = 0
+        self._lock = threading.Lock()
+
+    def admit(self):
+        """
+        Returns (wait, probe): wait is 0 if the caller may send its request now, otherwise how long to sleep
+        before asking again, and probe tells whether the request is the probe of an open breaker.
+        The outcome of the request is reported with the same probe flag.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0, False
+            remaining = self.opened_at + self.cooldown - time.monotonic()
+            if remaining > 0:
+                return min(remaining, self.poll_interval), False
+            if self.probing:
+                return self.poll_interval, False
+            self.probing = True
+            return 0.0, True
+
+    def on_success(self, probe=False):
+        with self._lock:
+            if self.opened_at is not None:
+                if not probe:
+                    return  # An answer to a request sent before the breaker opened says nothing of the provider now
+                logging.info("Provider answered again, closing the circuit breaker")
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def on_failure(self, probe=False):
+        with self._lock:
+            self.failures += 1
+            if probe or (self.opened_at is None and self.failures >= self.failure_threshold):
+                if self.opened_at is None:
+                    self.opens += 1
+                    logging.warning(f"{self.failures} consecutive provider failures, pausing requests "
+                                    f"for {self.cooldown:.0f}s")
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+    def on_neutral(self, probe=False):
+        # A probe that ended with an error the provider is not to blame for still frees the probe slot
+        if probe:
+            with self._lock:
+                self.probing = False
+
+
+class RetryStats:
+    """
+    Thread-safe counters of the calls made through a RetryEngine, for logs and dashboards.
+    """
+
+    def __init__(self, latency_window=1000):
+        self.counters = Counter()
+        self.retries = Counter()
+        self.errors = Counter()
+        self.latencies = deque(maxlen=latency_window)
+        self.total_latency = 0.0
+        self._lock = threading.Lock()
+
+    def record_attempt(self, latency, error_class=None):
+        with self._lock:
+            self.counters["attempts"] += 1
+            self.latencies.append(latency)
+            self.total_latency += latency
+            if error_class:
+                self.errors[error_class] += 1
+
+    def record_retry(self, error_class):
+        with self._lock:
+            self.retries[error_class] += 1
+
+    def record_result(self, succeeded):
+        with self._lock:
+            self.counters["succeeded" if succeeded else "failed"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            snapshot = {
+                "calls_succeeded": self.counters["succeeded"],
+                "calls_failed": self.counters["failed"],
+                "attempts": self.counters["attempts"],
+                "retries": dict(self.retries),
+                "errors": dict(self.errors),
+                "latency_mean_s": self.total_latency / self.counters["attempts"] if self.counters["attempts"] else 0.0,
+            }
+        for name, quantile in (("latency_p50_s", 0.5), ("latency_p95_s", 0.95), ("latency_max_s", 1.0)):
+            snapshot[name] = latencies[min(len(latencies) - 1, int(quantile * len(latencies)))] if latencies else 0.0
+        return snapshot
+
+
+class RetryEngine:
+    """
+    Resilient call layer shared by every chat completion: waits for the rate limiter, retries
+    failures with exponential backoff and full jitter according to the policy of their error class,
+    and pauses all callers through a circuit breaker while the provider is failing.
+    """
+
+    def __init__(self, policies=None, breaker=None):
+        self.policies = {**DEFAULT_POLICIES, **(policies or {})}
+        self.breaker = breaker or CircuitBreaker()
+        self.stats = RetryStats()
+
+    def _after_failure(self, error, attempt, rate_limiter, probe=False):
+        """
+        Records a failed attempt and returns the delay before retrying, or None if the error must be raised.
+        """
+        error_class = classify_error(error)
+        policy = self.policies[error_class]
+        if policy.trips_breaker:
+            self.breaker.on_failure(probe)
+        else:
+            self.breaker.on_neutral(probe)
+        if attempt >= policy.max_attempts:
+            self.stats.record_result(False)
+            return None
+
+        self.stats.record_retry(error_class)
+        delay = policy.delay(attempt)
+        if error_class == "rate_limit":
+            retry_after = retry_after_seconds(error)
+            if rate_limiter:
+                rate_limiter.on_rate_limited(retry_after)
+                delay = 0.0  # The limiter itself holds every caller back until the pause is over
+            elif retry_after is not None:
+                delay = max(delay, retry_after)
+        logging.warning(f"{type(error).__name__} ({error_class}) on attempt {attempt}, retrying in {delay:.1f}s")
+        return delay
+
+    def _after_success(self, response, rate_limiter, estimated_tokens, probe=False):
+        self.breaker.on_success(probe)
+        self.stats.record_result(True)
+        if rate_limiter:
+            usage = getattr(response, "usage", None)
+            rate_limiter.on_success(estimated_tokens, getattr(usage, "total_tokens", None))
+
+    def call(self, request, rate_limiter=None, estimated_tokens=0):
+        """
+        Runs `request()` under the retry policies, returning its response or raising its last error.
+        """
+        attempt = 0
+        while True:
+            wait, probe = self.breaker.admit()
+            while wait > 0:
+                time.sleep(wait)
+                wait, probe = self.breaker.admit()
+            if rate_limiter:
+                rate_limiter.acquire(estimated_tokens)
+            attempt += 1
+            started = time.monotonic()
+            try:
+                response = request()
+            except Exception as e:
+                self.stats.record_attempt(time.monotonic() - started, classify_error(e))
+                delay = self._after_failure(e, attempt, rate_limiter, probe)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self.stats.record_attempt(time.monotonic() - started)
+            self._after_success(response, rate_limiter, estimated_tokens, probe)
+            return response
+
+    async def call_async(self, request, rate_limiter=None, estimated_tokens=0):
+        """
+        Same as call for a coroutine function `request`.
+        """
+        import asyncio
+
+        attempt = 0
+        while True:
+            wait, probe = self.breaker.admit()
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait, probe = self.breaker.admit()
+            if rate_limiter:
+                await rate_limiter.acquire_async(estimated_tokens)
+            attempt += 1
+            started = time.monotonic()
+            try:
+                response = await request()
+            except Exception as e:
+                self.stats.record_attempt(time.monotonic() - started, classify_error(e))
+                delay = self._after_failure(e, attempt, rate_limiter, probe)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self.stats.record_attempt(time.monotonic() - started)
+            self._after_success(response, rate_limiter, estimated_tokens, probe)
+            return response
+
+    def report(self, metrics_file=None):
+        """
+        Logs the call counters and, if metrics_file is given, writes them there as JSON for dashboards.
+        """
+        snapshot = self.stats.snapshot()
+        snapshot["breaker_opens"] = self.breaker.opens
+        if snapshot["attempts"]:
+            logging.info(f"API calls: {snapshot['calls_succeeded']} succeeded, {snapshot['calls_failed']} failed, "
+                         f"{sum(snapshot['retries'].values())} retries {snapshot['retries'] or ''}, latency p50 "
+                         f"{snapshot['latency_p50_s']:.2f}s p95 {snapshot['latency_p95_s']:.2f}s")
+        if metrics_file:
+            with open(metrics_file, 'w', encoding='utf-8') as metrics:
+                json.dump(snapshot, metrics, indent=2)
+        return snapshot